@@ -0,0 +1,79 @@
+"""
+Measures the time and memory trade-off of activation checkpointing in VGG19.
+
+Every (resolution, blocks per segment) configuration runs in a fresh process, which reports the
+seconds per forward/backward pass of the style transfer loss and its peak resident memory.
+Weights are random, which does not change the cost of the network.
+
+    python benchmarks/activation_checkpointing.py --sizes 512 1024 2048 --checkpoint_blocks 0 1 2
+"""
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT)
+from argparse import ArgumentParser
+
+
+def measure(size: int, checkpoint_blocks: int, repeats: int) -> dict:
+    """
+    Runs the loss forward/backward at one configuration in this process.
+    """
+    import torch
+
+    from nst.layers import PRESETS
+    from nst.models.vgg19 import VGG19
+    from nst.train import build_losses, compute_style_grams
+
+    device = torch.device("cpu")
+    spec = PRESETS["gatys"]
+    mean = torch.tensor([0.485, 0.456, 0.406])
+    std = torch.tensor([0.229, 0.224, 0.225])
+    model = VGG19(mean=mean, std=std, taps=spec.taps, checkpoint_blocks=checkpoint_blocks).freeze()
+
+    content = torch.rand(1, 3, size, size)
+    grams = dict(zip(spec.style, compute_style_grams(model, torch.rand(1, 3, size, size), list(spec.style))))
+    content_losses, style_losses = build_losses(model, content, grams, device, list(spec.content))
+    x = content.clone().requires_grad_()
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        outputs = model(x)
+        losses = list(content_losses.items()) + list(style_losses.items())
+        loss = sum(criterion(outputs[layer]) for layer, criterion in losses)
+        loss.backward()
+        x.grad = None
+        times.append(time.perf_counter() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {"seconds": min(times), "peak_mb": peak / 1024, "pass_mb": max(peak - baseline, 0) / 1024}
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", default=[512, 1024, 2048], type=int, nargs="+")
+    parser.add_argument("--checkpoint_blocks", default=[0, 1, 2], type=int, nargs="+")
+    parser.add_argument("--repeats", default=3, type=int)
+    parser.add_argument("--worker", default=None, type=int, nargs=2)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(measure(args.worker[0], args.worker[1], args.repeats)))
+        return
+
+    print(f"{'size':>6} {'blocks':>7} {'seconds':>8} {'peak MB':>9} {'pass MB':>9}")
+    for size in args.sizes:
+        for blocks in args.checkpoint_blocks:
+            result = subprocess.run([sys.executable, __file__, "--worker", str(size), str(blocks),
+                                     "--repeats", str(args.repeats)], stdout=subprocess.PIPE, check=True)
+            stats = json.loads(result.stdout.decode().strip().splitlines()[-1])
+            print(f"{size:>6} {blocks:>7} {stats['seconds']:>8.3f} {stats['peak_mb']:>9.0f} {stats['pass_mb']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
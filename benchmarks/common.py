@@ -0,0 +1,61 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import torch
+
+from nst.budget import Budget
+from nst.metrics import Reporter
+
+from typing import Dict, List, Optional, Union
+
+
+class TargetBudget(Budget):
+    """
+    Stops once the loss of a closure evaluation reaches ``ratio`` times the initial loss, and records
+    the seconds, evaluations and iterations it took.
+
+    The losses are watched by ``reporter()``, which must be flushed after every evaluation, so that an
+    optimizer taking many evaluations per step is not charged for the rest of the step.
+    """
+    def __init__(self, ratio: float, max_evals: Optional[int]=None) -> None:
+        super(TargetBudget, self).__init__(max_evals=max_evals)
+        self.ratio = ratio
+        self.target = None
+        self.iterations = 0
+        self.reached: Optional[float] = None
+        self.reached_evaluations: Optional[int] = None
+        self.reached_iterations: Optional[int] = None
+
+    def reporter(self) -> Reporter:
+        """
+        Returns the reporter to record the metrics with, using ``flush_every=1``.
+        """
+        return TargetReporter(self)
+
+    def observe(self, evaluation: int, loss: float) -> None:
+        """
+        Checks the total loss of one evaluation against the target.
+        """
+        if self.target is None:
+            self.target = self.ratio * loss
+        elif loss <= self.target and self.reached is None:
+            self.reached = self.elapsed()
+            self.reached_evaluations = evaluation + 1
+            self.reached_iterations = self.iterations + 1
+            self.stop_reason = "target"
+
+    def update(self, loss: Union[torch.Tensor, float]) -> bool:
+        self.iterations += self.reached is None
+        return self.exhausted()
+
+
+class TargetReporter(Reporter):
+    """
+    Hands the total loss of every evaluation to a ``TargetBudget``.
+    """
+    def __init__(self, budget: TargetBudget) -> None:
+        self.budget = budget
+
+    def report(self, evaluation: int, rows: List[Dict[str, float]]) -> None:
+        for i, row in enumerate(rows):
+            self.budget.observe(evaluation + i, row["total loss"])
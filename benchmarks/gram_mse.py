@@ -0,0 +1,78 @@
+"""
+Compares the fused Gram-MSE style loss against the unfused one at the shapes of the style layers.
+
+For every resolution and style layer, random features of the layer's shape go through the style
+loss and its backward --repeats times. It reports the mean seconds per forward/backward pass and
+the bytes autograd saves for backward, which needs torch.autograd.graph.saved_tensors_hooks (torch>=1.10).
+
+    python benchmarks/gram_mse.py --sizes 512 1024 --repeats 10
+"""
+import os
+import sys
+import time
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT)
+from argparse import ArgumentParser
+
+import torch
+
+from nst.layers import PRESETS
+from nst.losses import StyleLoss
+from nst.models.vgg19 import tap_scale
+
+from typing import Optional, Tuple
+
+# output channels of the convolutions of each VGG19 block
+CHANNELS = {1: 64, 2: 128, 3: 256, 4: 512, 5: 512}
+
+
+def loss_pass(style_loss: StyleLoss, features: torch.Tensor) -> Tuple[float, Optional[int]]:
+    """
+    Returns the seconds of one forward/backward pass and the bytes saved for backward, None if
+    they cannot be measured. Tensors sharing storage, like the features and their transpose, count once.
+    """
+    saved = {}
+
+    def pack(tensor: torch.Tensor) -> torch.Tensor:
+        saved[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+        return tensor
+
+    hooks = getattr(getattr(torch.autograd, "graph", None), "saved_tensors_hooks", None)
+    start = time.perf_counter()
+    if hooks is not None:
+        with hooks(pack, lambda tensor: tensor):
+            loss = style_loss(features)
+    else:
+        loss = style_loss(features)
+    loss.backward()
+    features.grad = None
+    return time.perf_counter() - start, sum(saved.values()) if hooks is not None else None
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", default=[512, 1024], type=int, nargs="+")
+    parser.add_argument("--repeats", default=10, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    print(f"{'size':>6} {'layer':>8} {'loss':>8} {'seconds':>9} {'saved MB':>9}")
+    for size in args.sizes:
+        for layer in PRESETS["gatys"].style:
+            side = size // tap_scale(layer)
+            features = torch.rand(1, CHANNELS[int(layer[4])], side, side).requires_grad_()
+            target = StyleLoss.compute_gram_matrix(torch.rand_like(features))
+
+            for name, fused in (("unfused", False), ("fused", True)):
+                style_loss = StyleLoss(target, features.device, is_gram=True, fused=fused)
+                # warm up the kernels
+                loss_pass(style_loss, features)
+                passes = [loss_pass(style_loss, features) for _ in range(args.repeats)]
+                seconds = sum(seconds for seconds, _ in passes) / len(passes)
+                saved = passes[0][1]
+                saved = f"{saved / 2 ** 20:.1f}" if saved is not None else "-"
+                print(f"{size:>6} {layer:>8} {name:>8} {seconds:>9.4f} {saved:>9}")
+
+
+if __name__ == "__main__":
+    main()
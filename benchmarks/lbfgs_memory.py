@@ -0,0 +1,109 @@
+"""
+Compares the memory-bounded L-BFGS against torch.optim.LBFGS on the bundled images.
+
+Every (resolution, optimizer) configuration runs in a fresh process until the relative loss
+improvement stalls below --tol or --iterations are spent, and reports the seconds, closure
+evaluations and final loss to get there, the size of the curvature history and the peak
+resident memory of the process.
+
+    python benchmarks/lbfgs_memory.py --sizes 512 1024 --configs torch fp32 bf16 fp16 capped wolfe
+"""
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT)
+from argparse import ArgumentParser
+
+# keyword arguments of nst.lbfgs.LBFGS per configuration, None is torch.optim.LBFGS
+CONFIGS = {
+    "torch": None,
+    "fp32": {},
+    "bf16": {"history_dtype": "bf16"},
+    "fp16": {"history_dtype": "fp16"},
+    "capped": {"history_dtype": "bf16", "max_history_mb": 256},
+    "wolfe": {"history_dtype": "bf16", "line_search_fn": "strong_wolfe"},
+}
+
+
+def measure(size: int, config: str, args) -> dict:
+    """
+    Runs one optimization at one configuration in this process.
+    """
+    import torch
+    import torch.optim as optim
+
+    from nst.budget import Budget
+    from nst.layers import PRESETS
+    from nst.lbfgs import LBFGS
+    from nst.metrics import MetricsRecorder, Reporter
+    from nst.train import build_model, build_losses, compute_style_grams, image_loader, train
+
+    device = torch.device("cpu")
+    spec = PRESETS["gatys"]
+    model = build_model(device, args.weights, spec)
+    content = image_loader(args.content, device, (size, size))
+    style = image_loader(args.style, device, (size, size))
+    grams = dict(zip(spec.style, compute_style_grams(model, style, list(spec.style))))
+    content_losses, style_losses = build_losses(model, content, grams, device, list(spec.content))
+
+    x = content.clone().requires_grad_()
+    optimizer = optim.LBFGS([x]) if CONFIGS[config] is None else LBFGS([x], **CONFIGS[config])
+
+    class LastLoss(Reporter):
+        loss = float("nan")
+
+        def report(self, evaluation, rows):
+            self.loss = rows[-1]["total loss"] if rows else self.loss
+
+    budget = Budget(tol=args.tol)
+    reporter = LastLoss()
+    metrics = MetricsRecorder(reporter, device=device)
+
+    start = time.perf_counter()
+    train(model, optimizer, content_losses, style_losses, x, iterations=args.iterations, spec=spec,
+          budget=budget, metrics=metrics)
+    seconds = time.perf_counter() - start
+
+    # both optimizers keep the history as lists of rows
+    state = optimizer.state[x]
+    history = sum(v.numel() * v.element_size() for v in state.get("old_dirs", []) + state.get("old_stps", []))
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"seconds": seconds, "evaluations": budget.evaluations, "loss": reporter.loss,
+            "history_mb": history / 2 ** 20, "peak_mb": peak / 1024}
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--content", default=os.path.join(ROOT, "images/content/dancing.jpg"), type=str)
+    parser.add_argument("--style", default=os.path.join(ROOT, "images/style/picasso.jpg"), type=str)
+    parser.add_argument("--sizes", default=[512, 1024], type=int, nargs="+")
+    parser.add_argument("--configs", default=list(CONFIGS), type=str, nargs="+", choices=list(CONFIGS))
+    parser.add_argument("--iterations", default=50, type=int)
+    parser.add_argument("--tol", default=1e-3, type=float)
+    parser.add_argument("--weights", default=None, type=str)
+    parser.add_argument("--worker", default=None, type=str, nargs=2)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(measure(int(args.worker[0]), args.worker[1], args)))
+        return
+
+    forwarded = ["--content", args.content, "--style", args.style, "--iterations", str(args.iterations),
+                 "--tol", str(args.tol)] + (["--weights", args.weights] if args.weights is not None else [])
+    print(f"{'size':>6} {'config':>8} {'seconds':>8} {'evals':>6} {'loss':>12} {'history MB':>11} {'peak MB':>9}")
+    for size in args.sizes:
+        for config in args.configs:
+            result = subprocess.run([sys.executable, __file__, "--worker", str(size), config] + forwarded,
+                                    stdout=subprocess.PIPE, check=True)
+            stats = json.loads(result.stdout.decode().strip().splitlines()[-1])
+            print(f"{size:>6} {config:>8} {stats['seconds']:>8.1f} {stats['evaluations']:>6} {stats['loss']:>12.4g} "
+                  f"{stats['history_mb']:>11.0f} {stats['peak_mb']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
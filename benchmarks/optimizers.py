@@ -0,0 +1,73 @@
+"""
+Measures the time to quality of the image optimizers on the bundled content/style pairs.
+
+For every resolution, pair and optimizer configuration, the optimization starts from the content
+image and stops at the first closure evaluation whose total loss falls below --target times the
+initial loss, reporting the wall time and closure evaluations it took ("-" if --max_evals ran out first).
+
+    python benchmarks/optimizers.py --sizes 256 512 --target 0.05 --max_evals 1000
+"""
+import os
+import sys
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT)
+from argparse import ArgumentParser
+
+import torch
+
+from benchmarks.common import TargetBudget
+from nst.layers import PRESETS
+from nst.metrics import MetricsRecorder
+from nst.optimizers import build_optimizer
+from nst.train import build_model, build_losses, compute_style_grams, image_loader, train
+
+# (optimizer, keyword arguments of build_optimizer) per configuration
+CONFIGS = {
+    "lbfgs": ("lbfgs", {}),
+    "lbfgs-hist20": ("lbfgs", {"history_size": 20}),
+    "lbfgs-wolfe": ("lbfgs", {"line_search_fn": "strong_wolfe"}),
+    "adam-cosine": ("adam", {"schedule": "cosine"}),
+    "adam-exp": ("adam", {"schedule": "exponential"}),
+    "adam-lbfgs": ("adam-lbfgs", {"warmup_steps": 50}),
+}
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--contents", default=["dancing.jpg", "desert.jpg", "neckarfront.jpg"], type=str, nargs="+")
+    parser.add_argument("--styles", default=["picasso.jpg", "gogh.jpg", "kandinsky.jpg"], type=str, nargs="+")
+    parser.add_argument("--sizes", default=[256, 512], type=int, nargs="+")
+    parser.add_argument("--configs", default=list(CONFIGS), type=str, nargs="+", choices=list(CONFIGS))
+    parser.add_argument("--target", default=0.05, type=float)
+    parser.add_argument("--max_evals", default=1000, type=int)
+    parser.add_argument("--weights", default=None, type=str)
+    parser.add_argument("--use_gpu", action="store_true")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if args.use_gpu and torch.cuda.is_available() else "cpu")
+    spec = PRESETS["gatys"]
+    model = build_model(device, args.weights, spec)
+
+    print(f"{'size':>6} {'pair':>28} {'config':>13} {'seconds':>8} {'evals':>6}")
+    for size in args.sizes:
+        for content_name, style_name in zip(args.contents, args.styles):
+            content = image_loader(os.path.join(ROOT, "images/content", content_name), device, (size, size))
+            style = image_loader(os.path.join(ROOT, "images/style", style_name), device, (size, size))
+            grams = dict(zip(spec.style, compute_style_grams(model, style, list(spec.style))))
+            content_losses, style_losses = build_losses(model, content, grams, device, list(spec.content))
+            pair = f"{content_name[:-4]}/{style_name[:-4]}"
+
+            for config in args.configs:
+                name, kwargs = CONFIGS[config]
+                x = content.clone().requires_grad_()
+                optimizer = build_optimizer(name, [x], total_steps=args.max_evals, **kwargs)
+                budget = TargetBudget(args.target, max_evals=args.max_evals)
+                train(model, optimizer, content_losses, style_losses, x, iterations=args.max_evals, spec=spec,
+                      budget=budget, metrics=MetricsRecorder(budget.reporter(), flush_every=1, device=device))
+                seconds = f"{budget.reached:.1f}" if budget.reached is not None else "-"
+                evaluations = budget.reached_evaluations if budget.reached is not None else "-"
+                print(f"{size:>6} {pair:>28} {config:>13} {seconds:>8} {evaluations:>6}")
+
+
+if __name__ == "__main__":
+    main()
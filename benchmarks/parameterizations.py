@@ -0,0 +1,71 @@
+"""
+Measures how many iterations each image parameterization needs to reach a target loss.
+
+For every resolution and parameterization, the optimization starts from the content image and
+stops at the first closure evaluation whose total loss falls below --target times the initial
+loss, reporting the iterations, closure evaluations and seconds it took ("-" if --iterations ran out first).
+
+    python benchmarks/parameterizations.py --sizes 256 512 --optimizer lbfgs --target 0.05
+"""
+import os
+import sys
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT)
+from argparse import ArgumentParser
+
+import torch
+
+from benchmarks.common import TargetBudget
+from nst.layers import PRESETS
+from nst.metrics import MetricsRecorder
+from nst.optimizers import OPTIMIZERS, build_optimizer
+from nst.parameterization import PARAMETERIZATIONS, parameterize
+from nst.train import build_model, build_losses, compute_style_grams, image_loader, train
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--content", default=os.path.join(ROOT, "images/content/dancing.jpg"), type=str)
+    parser.add_argument("--style", default=os.path.join(ROOT, "images/style/picasso.jpg"), type=str)
+    parser.add_argument("--sizes", default=[256, 512], type=int, nargs="+")
+    parser.add_argument("--parameterizations", default=list(PARAMETERIZATIONS), type=str, nargs="+",
+                        choices=list(PARAMETERIZATIONS))
+    parser.add_argument("--optimizer", default="lbfgs", type=str, choices=list(OPTIMIZERS))
+    parser.add_argument("--target", default=0.05, type=float)
+    parser.add_argument("--iterations", default=300, type=int)
+    parser.add_argument("--weights", default=None, type=str)
+    parser.add_argument("--use_gpu", action="store_true")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if args.use_gpu and torch.cuda.is_available() else "cpu")
+    spec = PRESETS["gatys"]
+    model = build_model(device, args.weights, spec)
+
+    print(f"{'size':>6} {'parameterization':>17} {'iterations':>11} {'evals':>6} {'seconds':>8}")
+    for size in args.sizes:
+        content = image_loader(args.content, device, (size, size))
+        style = image_loader(args.style, device, (size, size))
+        grams = dict(zip(spec.style, compute_style_grams(model, style, list(spec.style))))
+        content_losses, style_losses = build_losses(model, content, grams, device, list(spec.content))
+
+        for name in args.parameterizations:
+            if name == "pixel":
+                image = content.clone().requires_grad_()
+                params = [image]
+            else:
+                image = parameterize(name, content)
+                params = list(image.parameters())
+            optimizer = build_optimizer(args.optimizer, params, total_steps=args.iterations)
+            budget = TargetBudget(args.target)
+            train(model, optimizer, content_losses, style_losses, image, iterations=args.iterations, spec=spec,
+                  budget=budget, metrics=MetricsRecorder(budget.reporter(), flush_every=1, device=device))
+
+            reached = budget.reached is not None
+            iterations = budget.reached_iterations if reached else "-"
+            evaluations = budget.reached_evaluations if reached else "-"
+            seconds = f"{budget.reached:.1f}" if reached else "-"
+            print(f"{size:>6} {name:>17} {iterations:>11} {evaluations:>6} {seconds:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Checks channels_last and bfloat16 execution of the loss network against the float32 loss curve.
+
+Every configuration runs the same L-BFGS optimization on the bundled images from the same start,
+and reports its seconds per closure evaluation and the relative deviation of its per-evaluation
+total loss from the float32 NCHW run (largest over the curve and at the last evaluation).
+
+    python benchmarks/precision.py --size 512 --iterations 20 --use_gpu
+"""
+import os
+import sys
+import time
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT)
+from argparse import ArgumentParser
+
+import torch
+import torch.optim as optim
+
+from nst.budget import Budget
+from nst.layers import PRESETS
+from nst.metrics import MetricsRecorder, Reporter
+from nst.models.precision import LossNetworkPrecision
+from nst.train import build_model, build_losses, compute_style_grams, image_loader, train
+
+from typing import Dict, List, Tuple
+
+# (channels_last, precision) configurations, the first one is the reference
+CONFIGS = [(False, "fp32"), (True, "fp32"), (False, "bf16"), (True, "bf16")]
+
+
+class CurveReporter(Reporter):
+    """
+    Keeps the total loss of every evaluation.
+    """
+    def __init__(self) -> None:
+        self.curve: List[float] = []
+
+    def report(self, evaluation: int, rows: List[Dict[str, float]]) -> None:
+        self.curve.extend(row["total loss"] for row in rows)
+
+
+def run(model: torch.nn.Module, content: torch.Tensor, style: torch.Tensor, device: torch.device,
+        iterations: int) -> Tuple[List[float], float]:
+    """
+    Returns the loss curve and the seconds per closure evaluation of one optimization.
+    """
+    spec = PRESETS["gatys"]
+    grams = dict(zip(spec.style, compute_style_grams(model, style, list(spec.style))))
+    content_losses, style_losses = build_losses(model, content, grams, device, list(spec.content))
+
+    x = content.clone().requires_grad_()
+    reporter = CurveReporter()
+    budget = Budget()
+    start = time.perf_counter()
+    train(model, optim.LBFGS([x]), content_losses, style_losses, x, iterations=iterations, spec=spec,
+          budget=budget, metrics=MetricsRecorder(reporter, device=device))
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return reporter.curve, (time.perf_counter() - start) / max(budget.evaluations, 1)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--content", default=os.path.join(ROOT, "images/content/dancing.jpg"), type=str)
+    parser.add_argument("--style", default=os.path.join(ROOT, "images/style/picasso.jpg"), type=str)
+    parser.add_argument("--size", default=512, type=int)
+    parser.add_argument("--iterations", default=20, type=int)
+    parser.add_argument("--weights", default=None, type=str)
+    parser.add_argument("--use_gpu", action="store_true")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if args.use_gpu and torch.cuda.is_available() else "cpu")
+    size = (args.size, args.size)
+    content = image_loader(args.content, device, size)
+    style = image_loader(args.style, device, size)
+
+    reference = None
+    print(f"{'layout':>14} {'precision':>10} {'s/eval':>8} {'max rel. dev':>13} {'final rel. dev':>15}")
+    for channels_last, precision in CONFIGS:
+        # a fresh model each time, channels_last converts the weights in place
+        model = LossNetworkPrecision(build_model(device, args.weights), channels_last, precision)
+        curve, seconds = run(model, content, style, device, args.iterations)
+        if reference is None:
+            reference = curve
+
+        steps = min(len(curve), len(reference))
+        deviations = [abs(a - b) / abs(b) for a, b in zip(curve[:steps], reference[:steps])]
+        layout = "channels_last" if channels_last else "contiguous"
+        print(f"{layout:>14} {precision:>10} {seconds:>8.3f} {max(deviations):>13.4f} {deviations[-1]:>15.4f}")
+
+
+if __name__ == "__main__":
+    main()
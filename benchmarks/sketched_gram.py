@@ -0,0 +1,81 @@
+"""
+Compares the sketched style loss against the exact one on the bundled images.
+
+For every resolution, sketch and sample rate it reports the relative error of the sketched style
+loss against the exact loss (mean and spread over redraws) and the time of a forward/backward pass.
+
+    python benchmarks/sketched_gram.py --sizes 512 1024 2048 --sample_rates 0.5 0.25 0.1
+"""
+import os
+import sys
+import time
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT)
+from argparse import ArgumentParser
+
+import torch
+
+from nst.layers import PRESETS
+from nst.losses import StyleLoss
+from nst.train import build_model, image_loader, compute_style_grams
+
+from typing import Dict, List, Tuple
+
+
+def style_loss_pass(model: torch.nn.Module, style_losses: Dict[str, StyleLoss], x: torch.Tensor) -> Tuple[float, float]:
+    """
+    Returns the total style loss and the seconds of one forward/backward pass.
+    """
+    start = time.perf_counter()
+    outputs = model(x)
+    loss = sum(style_loss(outputs[layer]) for layer, style_loss in style_losses.items())
+    loss.backward()
+    value = loss.item()
+    return value, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--content", default=os.path.join(ROOT, "images/content/dancing.jpg"), type=str)
+    parser.add_argument("--style", default=os.path.join(ROOT, "images/style/picasso.jpg"), type=str)
+    parser.add_argument("--sizes", default=[512, 1024], type=int, nargs="+")
+    parser.add_argument("--sample_rates", default=[0.5, 0.25, 0.1], type=float, nargs="+")
+    parser.add_argument("--sketches", default=["subsample", "countsketch"], type=str, nargs="+")
+    parser.add_argument("--repeats", default=5, type=int)
+    parser.add_argument("--weights", default=None, type=str)
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    spec = PRESETS["gatys"]
+    model = build_model(device, args.weights, spec)
+    model.set_taps(list(spec.style))
+
+    print(f"{'size':>6} {'sketch':>12} {'rate':>6} {'rel. error':>12} {'std':>8} {'seconds':>8}")
+    for size in args.sizes:
+        size = (size, size)
+        grams = compute_style_grams(model, image_loader(args.style, device, size), list(spec.style))
+        x = image_loader(args.content, device, size).requires_grad_()
+
+        exact_losses = {layer: StyleLoss(gram, device, is_gram=True) for layer, gram in zip(spec.style, grams)}
+        exact, exact_time = style_loss_pass(model, exact_losses, x)
+        print(f"{size[0]:>6} {'exact':>12} {1.0:>6.2f} {0.0:>12.4f} {0.0:>8.4f} {exact_time:>8.3f}")
+
+        for sketch in args.sketches:
+            for rate in args.sample_rates:
+                losses = {layer: StyleLoss(gram, device, is_gram=True, sample_rate=rate, sketch=sketch)
+                          for layer, gram in zip(spec.style, grams)}
+                errors: List[float] = []
+                times: List[float] = []
+                for _ in range(args.repeats):
+                    for loss in losses.values():
+                        loss.resample()
+                    value, seconds = style_loss_pass(model, losses, x)
+                    errors.append((value - exact) / exact)
+                    times.append(seconds)
+                errors_t = torch.tensor(errors)
+                print(f"{size[0]:>6} {sketch:>12} {rate:>6.2f} {errors_t.mean().item():>12.4f} "
+                      f"{errors_t.std().item():>8.4f} {sum(times) / len(times):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
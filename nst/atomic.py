@@ -0,0 +1,31 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+from typing import BinaryIO, Iterator
+
+
+@contextmanager
+def atomic_write(path: str, fsync: bool=False) -> Iterator[BinaryIO]:
+    """
+    Opens a temporary file next to ``path`` for binary writing and renames it into place once the
+    block completes, so readers never see a partial file. The temporary file is removed if the
+    block raises.
+
+    Args:
+        path (str): The destination path.
+        fsync (bool): Whether to flush the file to the disk before the rename, so that the new
+                      content also survives a crash of the machine.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,109 @@
+import time
+
+import torch
+
+from typing import Any, Dict, Optional, Union
+
+
+class BudgetExhausted(Exception):
+    """
+    Raised by a closure evaluation once a budget has run out, ending the optimizer step early.
+    """
+
+
+class Budget:
+    """
+    Stopping rules for the style transfer optimization.
+
+    Tracks the number of closure evaluations and the wall-clock time spent across one or more
+    ``train()`` calls, and detects convergence when the relative loss improvement over the last
+    ``window`` iterations falls below ``tol``.
+    """
+    def __init__(self, max_evals: Optional[int]=None, max_time: Optional[float]=None,
+                 tol: Optional[float]=None, window: int=5) -> None:
+        self.max_evals = max_evals
+        self.max_time = max_time
+        self.tol = tol
+        self.window = window
+        self.evaluations = 0
+        self.accepted_steps = 0
+        self.stop_reason = None
+        self._start_time = None
+        self._losses = []
+
+    def __str__(self) -> str:
+        reason = f", stopped on {self.stop_reason}" if self.stop_reason is not None else ""
+        per_step = f" ({self.evaluations / self.accepted_steps:.2f} per accepted step)" if self.accepted_steps else ""
+        return f"{self.evaluations} closure evaluations{per_step} in {self.elapsed():.1f}s{reason}"
+
+    def begin(self) -> None:
+        """
+        Starts the clock on first use and resets the convergence window, e.g. for a new pyramid level.
+        """
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+        self._losses = []
+        if self.stop_reason == "convergence":
+            self.stop_reason = None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start_time if self._start_time is not None else 0.0
+
+    def remaining_evals(self) -> Optional[int]:
+        return max(self.max_evals - self.evaluations, 0) if self.max_evals is not None else None
+
+    def count(self) -> None:
+        """
+        Records one closure evaluation.
+        """
+        self.evaluations += 1
+
+    def accept(self, steps: int) -> None:
+        """
+        Records steps accepted by the optimizer, for the evaluations spent per accepted step.
+        """
+        self.accepted_steps += steps
+
+    def update(self, loss: Union[torch.Tensor, float]) -> bool:
+        """
+        Records the loss of an iteration and checks the stopping rules.
+
+        The loss is only read back from the device when a tolerance is set.
+
+        Args:
+            loss (Union[torch.Tensor, float]): The total loss at the start of the iteration.
+
+        Returns:
+            stop (bool): Whether the optimization should stop.
+        """
+        if self.tol is not None:
+            self._losses.append(float(loss))
+            if len(self._losses) > self.window:
+                previous = self._losses[-self.window - 1]
+                improvement = (previous - self._losses[-1]) / max(abs(previous), 1e-12)
+                if improvement < self.tol:
+                    self.stop_reason = "convergence"
+        return self.exhausted()
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Returns the counters and convergence window, the clock is not part of the state.
+        """
+        return {"evaluations": self.evaluations, "accepted_steps": self.accepted_steps, "losses": list(self._losses)}
+
+    def load_state_dict(self, state: Dict[str, Any]) -> None:
+        self.evaluations = state["evaluations"]
+        self.accepted_steps = state["accepted_steps"]
+        self._losses = list(state["losses"])
+
+    def exhausted(self) -> bool:
+        """
+        Returns whether any stopping rule has been hit.
+        """
+        if self.stop_reason is not None:
+            return True
+        if self.max_evals is not None and self.evaluations >= self.max_evals:
+            self.stop_reason = "evaluation budget"
+        elif self.max_time is not None and self.elapsed() >= self.max_time:
+            self.stop_reason = "time budget"
+        return self.stop_reason is not None
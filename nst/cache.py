@@ -0,0 +1,137 @@
+import os
+import time
+import hashlib
+
+import torch
+
+from nst.atomic import atomic_write
+
+from typing import BinaryIO, Callable, List, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# temporary files older than this were left behind by killed writers
+STALE_SECONDS = 3600
+
+# file types of the entries, tensor lists and traced TorchScript loss graphs
+SUFFIXES = (".pt", ".ts")
+
+T = TypeVar("T")
+
+
+class TensorCache:
+    """
+    Size-bounded on-disk cache of tensor lists that can be shared between concurrent processes.
+
+    Entries are written to a temporary file and renamed into place, so readers only ever see
+    complete entries. A hit refreshes the entry's modification time and the least recently used
+    entries are evicted once the cache grows past ``max_bytes``, together with temporary files
+    left behind by writers that were killed before the rename. Other artifacts, like the compiled
+    loss graphs, are stored with ``load_file`` and ``store_file`` and share the same size bound.
+    """
+    def __init__(self, root: str, max_bytes: int=1 << 30) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Hashes the given parts (bytes or anything with a stable ``repr``) into a cache key.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else repr(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str, suffix: str=".pt") -> str:
+        return os.path.join(self.root, f"{key}{suffix}")
+
+    def load(self, key: str) -> Optional[List[torch.Tensor]]:
+        """
+        Returns the cached tensors (on CPU) for ``key``, or None on a miss.
+        """
+        return self.load_file(key, ".pt", lambda path: torch.load(path, map_location="cpu"))
+
+    def store(self, key: str, tensors: List[torch.Tensor]) -> None:
+        """
+        Stores detached CPU copies of ``tensors`` under ``key`` and evicts old entries if needed.
+        """
+        tensors = [tensor.detach().to("cpu") for tensor in tensors]
+        self.store_file(key, ".pt", lambda f: torch.save(tensors, f))
+
+    def load_file(self, key: str, suffix: str, load: Callable[[str], T]) -> Optional[T]:
+        """
+        Returns ``load`` applied to the path of the entry for ``key``, or None on a miss.
+
+        Args:
+            key (str): The cache key.
+            suffix (str): The file type of the entry, one of ``SUFFIXES``.
+            load (Callable): Reads the entry from its path.
+        """
+        path = self._path(key, suffix)
+        try:
+            value = load(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # unreadable entry, e.g. written by an incompatible version
+            self._remove(path)
+            return None
+        return value
+
+    def store_file(self, key: str, suffix: str, save: Callable[[BinaryIO], None]) -> None:
+        """
+        Stores the entry for ``key`` written by ``save`` to a binary file and evicts old entries if needed.
+
+        Args:
+            key (str): The cache key.
+            suffix (str): The file type of the entry, one of ``SUFFIXES``.
+            save (Callable): Writes the entry to an open binary file.
+        """
+        if suffix not in SUFFIXES:
+            raise ValueError(f"unknown cache entry type {suffix}, expected one of {SUFFIXES}")
+        with atomic_write(self._path(key, suffix)) as f:
+            save(f)
+        self._evict()
+
+    def _evict(self) -> None:
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries = []
+            now = time.time()
+            for name in os.listdir(self.root):
+                if not name.endswith(SUFFIXES + (".tmp",)):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    # recent ones may still be written by another process
+                    if now - stat.st_mtime > STALE_SECONDS:
+                        self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,150 @@
+import os
+import queue
+import hashlib
+import threading
+
+import torch
+from torch import nn
+
+from nst.atomic import atomic_write
+from nst.budget import Budget
+from nst.metrics import MetricsRecorder
+
+from typing import Any, Dict, Optional, Union
+
+
+def targets_hash(content_losses: Dict[str, nn.Module], style_losses: Dict[str, nn.Module]) -> str:
+    """
+    Hashes the layers and target tensors of the losses, so that a checkpoint is only resumed
+    against the same content and style targets.
+    """
+    digest = hashlib.sha256()
+    for losses in (content_losses, style_losses):
+        for layer, loss in losses.items():
+            digest.update(layer.encode())
+            digest.update(loss.target.detach().to("cpu").contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _snapshot(value: Any) -> Any:
+    """
+    Copies the tensors of a nested state to CPU, so that training can go on while it is written.
+    """
+    if torch.is_tensor(value):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: _snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_snapshot(item) for item in value)
+    return value
+
+
+class Checkpointer:
+    """
+    Periodically saves the state of an optimization, and restores it to resume the run exactly.
+
+    A checkpoint holds the optimized image (or the state of its parameterization), the optimizer
+    state, the pyramid level and iteration, the budget and metrics counters, the random number
+    generator states and a hash of the loss targets. The state is copied to CPU on the training
+    thread and written by a background thread to a temporary file that is then renamed into
+    place, so a preempted run always leaves the previous complete checkpoint behind.
+    """
+    def __init__(self, path: str, every: int=50, resume: bool=False) -> None:
+        self.path = path
+        self.every = every
+        self.level = 0
+        self.resumed = None
+        if resume:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"no checkpoint to resume from at {path}")
+            self.resumed = torch.load(path, map_location="cpu")
+
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def skip_level(self, level: int) -> bool:
+        """
+        Returns whether a pyramid level was completed before the resumed checkpoint was saved.
+        """
+        return self.resumed is not None and level < self.resumed["level"]
+
+    def restore(self, x: Union[torch.Tensor, nn.Module], optimizer, budget: Budget, metrics: MetricsRecorder,
+                targets: str) -> int:
+        """
+        Restores the resumed checkpoint into a fresh optimization of the current level.
+
+        Args:
+            x (Union[torch.Tensor, nn.Module]): The optimized image or its parameterization.
+            optimizer: The optimizer of the image.
+            budget (Budget): The budget, started for this level.
+            metrics (MetricsRecorder): The loss metrics.
+            targets (str): The hash of the targets of the current losses.
+
+        Returns:
+            iteration (int): The iteration to continue from, 0 if nothing was resumed.
+        """
+        state = self.resumed
+        if state is None or state["level"] != self.level:
+            return 0
+        if state["targets"] != targets:
+            raise ValueError(f"checkpoint {self.path} was saved for different content or style targets")
+        self.resumed = None
+
+        with torch.no_grad():
+            if torch.is_tensor(x):
+                x.copy_(state["image"])
+            else:
+                x.load_state_dict(state["image"])
+        optimizer.load_state_dict(state["optimizer"])
+        budget.load_state_dict(state["budget"])
+        metrics.evaluations = state["metrics"]
+        torch.set_rng_state(state["rng"])
+        if state["cuda_rng"] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state["cuda_rng"])
+        return state["iteration"]
+
+    def save(self, iteration: int, x: Union[torch.Tensor, nn.Module], optimizer, budget: Budget,
+             metrics: MetricsRecorder, targets: str) -> None:
+        """
+        Snapshots the state after ``iteration`` iterations of the current level and queues it for writing.
+        """
+        self._raise()
+        state = _snapshot({
+            "level": self.level,
+            "iteration": iteration,
+            "image": x if torch.is_tensor(x) else x.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "budget": budget.state_dict(),
+            "metrics": metrics.evaluations + metrics.size,
+            "rng": torch.get_rng_state(),
+            "cuda_rng": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            "targets": targets,
+        })
+        # waits for the previous checkpoint to be written
+        self._queue.put(state)
+
+    def close(self) -> None:
+        """
+        Waits for the pending checkpoint to be written.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._raise()
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self) -> None:
+        while True:
+            state = self._queue.get()
+            if state is None:
+                return
+            try:
+                with atomic_write(self.path, fsync=True) as f:
+                    torch.save(state, f)
+            except BaseException as error:
+                self._error = error
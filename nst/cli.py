@@ -0,0 +1,200 @@
+import os
+from argparse import ArgumentParser, Namespace
+
+from typing import Tuple
+
+# args holding file system paths, resolved before a job is sent to the worker
+PATH_ARGS = ("content_dir", "style_dir", "output_dir", "weights", "cache_dir", "metrics_path", "checkpoint_path",
+             "roi_base", "roi_mask")
+
+# default unix socket of the worker
+DEFAULT_SOCKET = "/tmp/nst-worker.sock"
+
+def build_parser() -> ArgumentParser:
+    """
+    Builds the command line parser shared by train.py and the worker client.
+
+    Kept free of torch imports so that the client starts quickly.
+
+    Returns:
+        parser (ArgumentParser): The command line parser.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--use_gpu", default=True, type=bool)
+    parser.add_argument("--content_dir", default=["../images/content/dancing.jpg"], type=str, nargs="+")
+    parser.add_argument("--style_dir", default=["../images/style/picasso.jpg"], type=str, nargs="+")
+    parser.add_argument("--input_image", default="content", type=str)
+    parser.add_argument("--output_dir", default=["../result/result.jpg"], type=str, nargs="+")
+    parser.add_argument("--image_size", default=(512, 512), type=parse_size)
+    parser.add_argument("--iterations", default=100, type=int)
+    parser.add_argument("--alpha", default=1, type=int)
+    parser.add_argument("--beta", default=1000000, type=int)
+    parser.add_argument("--style_layer_weight", default=1.0, type=float)
+    parser.add_argument("--layers", default="gatys", type=str)
+    parser.add_argument("--content_layers", default=None, type=parse_tap, nargs="+")
+    parser.add_argument("--style_layers", default=None, type=parse_tap, nargs="+")
+    parser.add_argument("--fused_style_loss", action="store_true")
+    parser.add_argument("--style_sample_rate", default=1.0, type=float)
+    parser.add_argument("--style_sketch", default="subsample", type=str, choices=["subsample", "countsketch"])
+    parser.add_argument("--weights", default=None, type=str)
+    parser.add_argument("--cache_dir", default=None, type=str)
+    parser.add_argument("--cache_size_mb", default=1024, type=int)
+    parser.add_argument("--pyramid", default=None, type=parse_level, nargs="+")
+    parser.add_argument("--tile_size", default=None, type=int)
+    parser.add_argument("--tile_overlap", default=64, type=int)
+    parser.add_argument("--distributed", action="store_true")
+    parser.add_argument("--activation_checkpointing", default=0, type=int)
+    parser.add_argument("--precision", default="fp32", type=str, choices=["fp32", "bf16"])
+    parser.add_argument("--channels_last", action="store_true")
+    parser.add_argument("--fuse_normalization", action="store_true")
+    parser.add_argument("--compile_loss", default=None, type=str, choices=["compile", "script"])
+    parser.add_argument("--parameterization", default="pixel", type=str, 
+                        choices=["pixel", "sigmoid", "decorrelated", "fourier", "laplacian"])
+    parser.add_argument("--optimizer", default="lbfgs", type=str, choices=["lbfgs", "adam", "adam-lbfgs"])
+    parser.add_argument("--lr", default=None, type=float)
+    parser.add_argument("--lr_schedule", default="cosine", type=str, choices=["constant", "cosine", "exponential"])
+    parser.add_argument("--lr_decay", default=0.99, type=float)
+    parser.add_argument("--warmup_steps", default=50, type=int)
+    parser.add_argument("--max_iter", default=20, type=int)
+    parser.add_argument("--history_size", default=100, type=int)
+    parser.add_argument("--max_history_mb", default=None, type=int)
+    parser.add_argument("--history_dtype", default="fp32", type=str, choices=["fp32", "fp16", "bf16"])
+    parser.add_argument("--line_search", default=None, type=str, choices=["strong_wolfe"])
+    parser.add_argument("--bounded", action="store_true")
+    parser.add_argument("--warm_start", action="store_true")
+    parser.add_argument("--refine_iterations", default=10, type=int)
+    parser.add_argument("--roi_base", default=None, type=str)
+    parser.add_argument("--roi", default=None, type=int, nargs=4, metavar=("TOP", "LEFT", "BOTTOM", "RIGHT"))
+    parser.add_argument("--roi_mask", default=None, type=str)
+    parser.add_argument("--checkpoint_path", default=None, type=str)
+    parser.add_argument("--checkpoint_every", default=50, type=int)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--max_evals", default=None, type=int)
+    parser.add_argument("--max_time", default=None, type=float)
+    parser.add_argument("--tol", default=None, type=float)
+    parser.add_argument("--tol_window", default=5, type=int)
+    parser.add_argument("--reporter", default="tqdm", type=str, choices=["tqdm", "jsonl", "silent"])
+    parser.add_argument("--report_every", default=20, type=int)
+    parser.add_argument("--metrics_path", default="metrics.jsonl", type=str)
+    return parser
+
+def check_args(parser: ArgumentParser, args: Namespace) -> None:
+    """
+    Checks the parsed command line args, exiting with a usage error if they are inconsistent.
+
+    Args:
+        parser (ArgumentParser): The parser that produced ``args``.
+        args (Namespace): The parsed command line args.
+    """
+    if len(args.style_dir) not in (1, len(args.content_dir)):
+        parser.error("--style_dir takes either one style image or one per content image")
+    if len(args.output_dir) != len(args.content_dir):
+        parser.error("--output_dir takes one path per content image")
+    if args.tile_size is not None and args.tile_overlap >= args.tile_size:
+        parser.error("--tile_overlap must be smaller than --tile_size")
+    if args.tile_size is not None and (args.max_evals is not None or args.max_time is not None):
+        parser.error("--max_evals and --max_time would leave the remaining tiles unstylized, "
+                     "use --tol with --tile_size")
+    if args.tile_size is not None and (args.pyramid is not None or args.input_image != "content"):
+        parser.error("--tile_size starts every tile from its content and cannot be combined with --pyramid "
+                     "or --input_image")
+    if args.tile_size is not None and any(os.path.splitext(path)[1].lower() not in (".ppm", ".tif", ".tiff")
+                                          for path in args.output_dir):
+        parser.error("--tile_size streams its rows to .ppm or .tif(f) --output_dir files")
+    if args.distributed and (args.pyramid is not None or args.tile_size is not None):
+        parser.error("--distributed runs a single level and cannot be combined with --pyramid or --tile_size")
+    if args.distributed and args.max_time is not None:
+        parser.error("--max_time would stop processes at different iterations, use --max_evals with --distributed")
+    if args.distributed and args.image_size[0] % 16:
+        parser.error("--distributed needs an image height that is a multiple of 16")
+    if args.distributed and (args.fused_style_loss or args.style_sample_rate < 1.0):
+        parser.error("--distributed computes exact sharded style losses and cannot be combined with "
+                     "--fused_style_loss or --style_sample_rate")
+    if args.distributed and args.parameterization != "pixel":
+        parser.error("--distributed only optimizes pixels, use the default --parameterization")
+    if args.bounded and (args.optimizer != "lbfgs" or args.line_search is not None or args.parameterization != "pixel"):
+        parser.error("--bounded needs --optimizer=lbfgs without --line_search on pixels")
+    if args.warm_start and (args.cache_dir is None or args.tile_size is not None or args.distributed):
+        parser.error("--warm_start needs --cache_dir and cannot be combined with --tile_size or --distributed")
+    if args.roi_base is not None and (args.roi is None) == (args.roi_mask is None):
+        parser.error("--roi_base needs exactly one of --roi or --roi_mask")
+    if args.roi_base is None and (args.roi is not None or args.roi_mask is not None):
+        parser.error("--roi and --roi_mask need the --roi_base result to edit")
+    if args.roi is not None and not (0 <= args.roi[0] < args.roi[2] <= args.image_size[0] 
+                                     and 0 <= args.roi[1] < args.roi[3] <= args.image_size[1]):
+        parser.error("--roi must be a non-empty TOP LEFT BOTTOM RIGHT box within --image_size")
+    if args.roi_base is not None and len(args.content_dir) != 1:
+        parser.error("--roi_base edits the result of a single content image")
+    if args.roi_base is not None and (args.pyramid is not None or args.tile_size is not None or args.distributed 
+                                      or args.warm_start or args.checkpoint_path is not None):
+        parser.error("--roi_base runs a single level and cannot be combined with --pyramid, --tile_size, "
+                     "--distributed, --warm_start or --checkpoint_path")
+    if args.roi_base is not None and (args.parameterization != "pixel" or args.compile_loss is not None 
+                                      or args.fused_style_loss or args.style_sample_rate < 1.0):
+        parser.error("--roi_base optimizes pixels with exact eager losses, it cannot be combined with "
+                     "--parameterization, --compile_loss, --fused_style_loss or --style_sample_rate")
+    if args.resume and args.checkpoint_path is None:
+        parser.error("--resume needs the --checkpoint_path to resume from")
+    if args.checkpoint_path is not None and (args.tile_size is not None or args.distributed):
+        parser.error("--checkpoint_path cannot be combined with --tile_size or --distributed")
+    if args.compile_loss is not None and (args.fused_style_loss or args.style_sample_rate < 1.0 or args.distributed):
+        parser.error("--compile_loss needs exact unfused style losses and cannot be combined with --distributed")
+    if args.compile_loss == "script" and (args.activation_checkpointing or args.precision != "fp32"):
+        parser.error("--compile_loss=script cannot trace --activation_checkpointing or --precision=bf16")
+
+def parse_level(level: str) -> Tuple[Tuple[int, int], int]:
+    """
+    Parses a pyramid level given as ``SIZE:ITERATIONS`` or ``HEIGHTxWIDTH:ITERATIONS``.
+
+    Args:
+        level (str): The level specification, e.g. ``256:50`` or ``256x384:50``.
+
+    Returns:
+        level (Tuple[Tuple[int, int], int]): The (height, width) of the level and its number of iterations.
+    """
+    size, iterations = level.split(":")
+    return parse_size(size), int(iterations)
+
+def parse_size(size: str) -> Tuple[int, int]:
+    """
+    Parses an image size given as ``SIZE`` or ``HEIGHTxWIDTH``.
+
+    Args:
+        size (str): The size specification, e.g. ``512`` or ``512x768``.
+
+    Returns:
+        size (Tuple[int, int]): The (height, width).
+    """
+    height, _, width = size.partition("x")
+    return int(height), int(width or height)
+
+def parse_tap(tap: str) -> Tuple[str, float]:
+    """
+    Parses a weighted VGG19 tap given as ``NAME`` or ``NAME:WEIGHT``.
+
+    Args:
+        tap (str): The tap specification, e.g. ``conv4_2`` or ``conv1_1:0.5``.
+
+    Returns:
+        tap (Tuple[str, float]): The tap name and its weight, 1.0 if not given.
+    """
+    name, _, weight = tap.partition(":")
+    return name, float(weight or 1.0)
+
+def resolve_paths(args: Namespace) -> Namespace:
+    """
+    Makes the path args absolute so that they can be used from another working directory.
+
+    Args:
+        args (Namespace): The parsed command line args.
+
+    Returns:
+        args (Namespace): The args with absolute paths.
+    """
+    for name in PATH_ARGS:
+        value = getattr(args, name, None)
+        if isinstance(value, list):
+            setattr(args, name, [os.path.abspath(path) for path in value])
+        elif value is not None:
+            setattr(args, name, os.path.abspath(value))
+    return args
@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import socket
+sys.path.append(os.path.abspath(os.path.pardir))
+
+from nst.cli import DEFAULT_SOCKET, build_parser, check_args, resolve_paths
+
+
+def main() -> None:
+    """
+    Sends a job with the same flags as ``train.py`` to a running worker and waits for it to finish.
+
+    ``--use_gpu`` and ``--weights`` are decided by the worker and ignored here.
+    """
+    parser = build_parser()
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, type=str)
+    args = parser.parse_args()
+    check_args(parser, args)
+
+    socket_path = args.socket
+    del args.socket
+    job = vars(resolve_paths(args))
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile("rwb") as stream:
+            stream.write((json.dumps(job) + "\n").encode())
+            stream.flush()
+            reply = json.loads(stream.readline())
+
+    if reply["status"] != "ok":
+        sys.exit(f"job failed: {reply['message']}")
+    print(f"{reply['evaluations']} closure evaluations in {reply['elapsed']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+
+import torch
+from torch import nn
+
+from nst.cache import TensorCache
+from nst.layers import LayerSpec
+from nst.losses import ContentLoss, StyleLoss
+
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+# compilation backends, "compile" uses torch.compile (torch>=2.0) and "script" a frozen TorchScript trace
+BACKENDS = ("compile", "script")
+
+
+class LossGraph(nn.Module):
+    """
+    The loss of one closure evaluation as a single module: the forward pass of the loss network,
+    the content and style losses and the weighted sums.
+
+    The targets are inputs rather than constants, so one compiled graph serves every content and
+    style image of the same size. The losses are only used for their formulas.
+    """
+    def __init__(self, model: nn.Module, spec: LayerSpec, content_losses: Dict[str, ContentLoss],
+                 style_losses: Dict[str, StyleLoss], alpha: float, beta: float, style_weight: float) -> None:
+        super(LossGraph, self).__init__()
+        self.model = model
+        self.spec = spec
+        self.content_losses = nn.ModuleDict({layer: content_losses[layer] for layer in spec.content})
+        self.style_losses = nn.ModuleDict({layer: style_losses[layer] for layer in spec.style})
+        self.alpha = alpha
+        self.beta = beta
+        self.style_weight = style_weight
+
+    def forward(self, x: torch.Tensor, content_targets: List[torch.Tensor],
+                style_targets: List[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        outputs = self.model(x)
+
+        total_content_loss = x.new_zeros(())
+        for (layer, weight), target in zip(self.spec.content.items(), content_targets):
+            total_content_loss = total_content_loss + weight * self.content_losses[layer](outputs[layer], target)
+
+        total_style_loss = x.new_zeros(())
+        for (layer, weight), target in zip(self.spec.style.items(), style_targets):
+            loss = self.style_losses[layer](outputs[layer], target)
+            total_style_loss = total_style_loss + self.style_weight * weight * loss
+
+        loss = (self.alpha * total_content_loss) + (self.beta * total_style_loss)
+        return total_content_loss, total_style_loss, loss
+
+
+class LossCompiler:
+    """
+    Compiles the loss of ``train()`` into one graph per image size.
+
+    With ``backend="compile"`` the graph is built by ``torch.compile`` and its kernels are cached by
+    inductor in the ``inductor`` folder of the cache. With ``backend="script"`` it is traced, frozen
+    with the network weights as constants and stored in ``cache``, keyed by the weights, layers, loss
+    weights and shapes, so later runs load it instead of tracing again and it is evicted with the
+    other entries. Compiled graphs are also kept in memory for the lifetime of the compiler.
+    """
+    def __init__(self, backend: str="compile", cache: Optional[TensorCache]=None) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend {backend}, expected one of {BACKENDS}")
+        if backend == "compile" and not hasattr(torch, "compile"):
+            raise RuntimeError("the compile backend needs torch.compile (torch>=2.0), use backend='script'")
+        self.backend = backend
+        self.cache = cache
+        if cache is not None and backend == "compile":
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache.root, "inductor"))
+            config = getattr(getattr(torch, "_inductor", None), "config", None)
+            if config is not None and hasattr(config, "fx_graph_cache"):
+                config.fx_graph_cache = True
+        self._graphs = {}
+
+    def __call__(self, model: nn.Module, spec: LayerSpec, content_losses: Dict[str, ContentLoss],
+                 style_losses: Dict[str, StyleLoss], x: torch.Tensor, alpha: float=1, beta: float=1000000,
+                 style_weight: Union[int, float]=1.0) -> Callable[[torch.Tensor], Tuple[torch.Tensor, ...]]:
+        """
+        Returns the compiled loss of ``x`` for the given losses.
+
+        Args:
+            model (nn.Module): The frozen VGG19 loss network.
+            spec (LayerSpec): The content and style layers and their weights.
+            content_losses (Dict[str, ContentLoss]): The content losses per layer, holding the targets.
+            style_losses (Dict[str, StyleLoss]): The style losses per layer, holding the targets.
+            x (torch.Tensor): The image that will be optimized.
+            alpha (float): The weight given to content loss.
+            beta (float): The weight given to style loss.
+            style_weight (Union[int, float]): The weight given to the style loss of each layer.
+
+        Returns:
+            loss_fn (Callable): Maps the image to its total content loss, total style loss and loss.
+        """
+        for layer in spec.style:
+            if style_losses[layer].fused or style_losses[layer].sample_rate < 1.0:
+                raise ValueError("compiled losses need exact unfused style losses")
+
+        content_targets = [content_losses[layer].target for layer in spec.content]
+        style_targets = [style_losses[layer].target for layer in spec.style]
+        targets = content_targets + style_targets
+        key = TensorCache.make_key(self.backend, torch.__version__, getattr(model, "weights_version", None),
+                                   repr(spec), alpha, beta, style_weight, str(x.device), x.dtype,
+                                   tuple(x.shape), [tuple(target.shape) for target in targets])
+
+        if key not in self._graphs:
+            graph = LossGraph(model, spec, content_losses, style_losses, alpha, beta, style_weight)
+            if self.backend == "compile":
+                self._graphs[key] = torch.compile(graph, dynamic=False)
+            else:
+                self._graphs[key] = self._script(key, graph, x, content_targets, style_targets)
+
+        compiled = self._graphs[key]
+        return lambda x: compiled(x, content_targets, style_targets)
+
+    def _script(self, key: str, graph: LossGraph, x: torch.Tensor, content_targets: List[torch.Tensor],
+                style_targets: List[torch.Tensor]) -> torch.jit.ScriptModule:
+        if self.cache is not None:
+            loaded = self.cache.load_file(key, ".ts", lambda path: torch.jit.load(path, map_location=x.device))
+            if loaded is not None:
+                return loaded
+
+        with torch.no_grad():
+            traced = torch.jit.trace(graph.eval(), (x.detach(), content_targets, style_targets), check_trace=False)
+        frozen = torch.jit.freeze(traced)
+
+        if self.cache is not None:
+            self.cache.store_file(key, ".ts", lambda f: torch.jit.save(frozen, f))
+        return frozen
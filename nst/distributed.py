@@ -0,0 +1,156 @@
+import torch
+from torch import nn
+import torch.nn.functional as F
+import torch.distributed as dist
+
+from nst.models.vgg19 import tap_scale, receptive_radius
+
+from typing import Dict, List, Tuple
+
+# every shard starts on a multiple of the coarsest tap stride so that pooling stays aligned
+ALIGNMENT = 16
+
+
+class AllReduceSum(torch.autograd.Function):
+    """
+    Sums a tensor over all processes.
+
+    Every process computes the same loss from the reduced value, so the gradient with respect to
+    the local contribution is the gradient with respect to the sum, which backward passes through.
+    """
+    @staticmethod
+    def forward(ctx, input: torch.Tensor) -> torch.Tensor:
+        output = input.clone()
+        dist.all_reduce(output)
+        return output
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor) -> torch.Tensor:
+        return grad_output
+
+
+def all_reduce_grad(grad: torch.Tensor) -> torch.Tensor:
+    """
+    Tensor hook summing the gradient of the replicated image over all processes.
+    """
+    grad = grad.clone()
+    dist.all_reduce(grad)
+    return grad
+
+
+def shard_rows(height: int, rank: int, world_size: int) -> Tuple[int, int]:
+    """
+    Returns the [start, end) rows of the image owned by a process.
+
+    Rows are split in blocks of ``ALIGNMENT`` so that every shard starts on a pooling boundary.
+
+    >>> [shard_rows(512, rank, 3) for rank in range(3)]
+    [(0, 176), (176, 352), (352, 512)]
+    """
+    blocks = height // ALIGNMENT
+    if blocks < world_size:
+        raise ValueError(f"cannot split {height} rows into {world_size} shards of {ALIGNMENT}-row blocks")
+    per_rank, extra = divmod(blocks, world_size)
+    start = ALIGNMENT * (rank * per_rank + min(rank, extra))
+    end = ALIGNMENT * ((rank + 1) * per_rank + min(rank + 1, extra))
+    return start, (end if rank < world_size - 1 else height)
+
+
+def halo_rows(taps: List[str]) -> int:
+    """
+    Returns the rows of context needed around a shard for exact features at the given taps.
+    """
+    radius = max(receptive_radius(tap) for tap in taps)
+    return -(-radius // ALIGNMENT) * ALIGNMENT
+
+
+class ShardedFeatures(nn.Module):
+    """
+    Runs the feature extractor on the rows of a process plus a halo, and returns the features of
+    the owned rows only.
+    """
+    def __init__(self, model: nn.Module, start: int, end: int, height: int, taps: List[str]) -> None:
+        super(ShardedFeatures, self).__init__()
+        self.model = model
+        self.start = start
+        self.end = end
+        halo = halo_rows(taps)
+        self.lo = max(start - halo, 0)
+        self.hi = min(end + halo, height)
+
+    def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        outputs = self.model(x[:, :, self.lo:self.hi])
+        owned = {}
+        for tap, feature in outputs.items():
+            scale = tap_scale(tap)
+            first = (self.start - self.lo) // scale
+            owned[tap] = feature[:, :, first:first + (self.end - self.start) // scale]
+        return owned
+
+
+class ShardedContentLoss(nn.Module):
+    """
+    Content loss over the whole image computed from the owned rows of every process.
+    """
+    def __init__(self, target: torch.Tensor, height: int) -> None:
+        super(ShardedContentLoss, self).__init__()
+        self.target = target.detach()
+        self.height = height
+
+    def __str__(self) -> str:
+        return "Content loss"
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        channels, width = input.size(1), input.size(3)
+        partial = (input - self.target.expand_as(input)).pow(2).sum()
+        return AllReduceSum.apply(partial).div(channels * self.height * width)
+
+
+class ShardedStyleLoss(nn.Module):
+    """
+    Style loss over the whole image, with Gram matrices summed from the owned rows of every process.
+    """
+    def __init__(self, target: torch.Tensor, height: int) -> None:
+        super(ShardedStyleLoss, self).__init__()
+        self.target = target.detach()
+        self.height = height
+
+    def __str__(self) -> str:
+        return "Style loss"
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        batch_size, channels, height, width = input.size()
+        features = input.reshape(batch_size, channels, height * width)
+        partial = torch.bmm(features, features.transpose(1, 2))
+        gram = AllReduceSum.apply(partial).div(channels * self.height * width)
+        return F.mse_loss(gram, self.target.expand_as(gram), reduction="sum").div(channels * channels)
+
+
+@torch.no_grad()
+def build_sharded_losses(features: ShardedFeatures, content: torch.Tensor, style_grams: Dict[str, torch.Tensor],
+                         content_layers: List[str],
+                         height: int) -> Tuple[Dict[str, ShardedContentLoss], Dict[str, ShardedStyleLoss]]:
+    """
+    Computes the content targets of the owned rows and wraps the targets in sharded losses.
+
+    Args:
+        features (ShardedFeatures): The sharded feature extractor of this process.
+        content (torch.Tensor): The full batch of content images.
+        style_grams (Dict[str, torch.Tensor]): The style gram matrices per style layer.
+        content_layers (List[str]): The content layers.
+        height (int): Height of the full image.
+
+    Returns:
+        content_losses (Dict[str, ShardedContentLoss]): The content losses per content layer.
+        style_losses (Dict[str, ShardedStyleLoss]): The style losses per style layer.
+    """
+    content_outputs = features(content)
+    content_losses = {}
+    for layer in content_layers:
+        content_losses[layer] = ShardedContentLoss(content_outputs[layer], height // tap_scale(layer))
+
+    style_losses = {}
+    for layer, gram in style_grams.items():
+        style_losses[layer] = ShardedStyleLoss(gram, height // tap_scale(layer))
+
+    return content_losses, style_losses
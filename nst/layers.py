@@ -0,0 +1,47 @@
+from nst.models.vgg19 import LAYERS
+
+from typing import Dict, List, Sequence, Union
+
+
+class LayerSpec:
+    """
+    Declarative choice of the VGG19 taps used for the content and style representations.
+
+    Each tap carries a weight in the total content or style loss. The union of the taps drives
+    target extraction, the loss assembly in ``train()`` and the truncation of the network.
+
+    >>> spec = LayerSpec(content=["conv4_2"], style={"conv1_1": 1.0, "conv2_1": 0.5})
+    >>> spec.taps
+    ['conv4_2', 'conv1_1', 'conv2_1']
+    """
+    def __init__(self, content: Union[Sequence[str], Dict[str, float]],
+                 style: Union[Sequence[str], Dict[str, float]]) -> None:
+        self.content = self._weights(content)
+        self.style = self._weights(style)
+        if not self.content or not self.style:
+            raise ValueError("at least one content and one style tap are required")
+
+    def __repr__(self) -> str:
+        return f"LayerSpec(content={self.content}, style={self.style})"
+
+    @staticmethod
+    def _weights(taps: Union[Sequence[str], Dict[str, float]]) -> Dict[str, float]:
+        weights = dict(taps) if isinstance(taps, dict) else {tap: 1.0 for tap in taps}
+        unknown = [tap for tap in weights if tap not in LAYERS]
+        if unknown:
+            raise ValueError(f"unknown VGG19 taps {unknown}, expected names from {LAYERS}")
+        return weights
+
+    @property
+    def taps(self) -> List[str]:
+        """
+        The taps needed by the content and style losses, without duplicates.
+        """
+        return list(dict.fromkeys(list(self.content) + list(self.style)))
+
+
+# named layer specs, "gatys" follows the paper and "fast" skips the conv5 block for thumbnails
+PRESETS = {
+    "gatys": LayerSpec(content=["conv4_2"], style=["conv1_1", "conv2_1", "conv3_1", "conv4_1", "conv5_1"]),
+    "fast": LayerSpec(content=["conv4_2"], style=["conv1_1", "conv2_1", "conv3_1", "conv4_1"]),
+}
@@ -0,0 +1,406 @@
+import torch
+from torch.optim import Optimizer
+from torch.optim.lbfgs import _strong_wolfe
+
+from typing import Callable, Iterable, Optional, Tuple
+
+# storage types of the curvature history
+HISTORY_DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+class LBFGS(Optimizer):
+    """
+    L-BFGS with a memory-bounded, optionally compressed curvature history.
+
+    Follows ``torch.optim.LBFGS``, but the (s, y) pairs live in two rings of at most ``history_size``
+    rows, capped so that they take at most ``max_history_mb``. The rings grow as pairs arrive, so
+    short runs only allocate the pairs they store. With a 16-bit
+    ``history_dtype`` each stored vector is divided by its largest magnitude before rounding, so
+    large gradients do not overflow float16, and every dot product of the two-loop recursion is
+    accumulated in float32 against the float32 gradient.
+
+    With ``bounds`` the iterates are kept inside a box by the optimizer itself, instead of being
+    clamped behind its back: variables held at a bound by the gradient are left out of the
+    direction, steps are projected back into the box, a backtracking line search along the
+    projected path accepts them, and the curvature pairs are taken from the projected steps.
+
+    Args:
+        params (Iterable): The parameters to optimize.
+        lr (float): Step length.
+        max_iter (int): Maximal number of iterations per optimization step.
+        max_eval (Optional[int]): Maximal number of closure evaluations per step, 1.25 * max_iter by default.
+        tolerance_grad (float): Termination tolerance on the largest gradient magnitude.
+        tolerance_change (float): Termination tolerance on the change of the loss or the parameters.
+        history_size (int): Maximal number of stored (s, y) pairs.
+        max_history_mb (Optional[int]): Caps the history buffers at this many MB by lowering ``history_size``.
+        history_dtype (str): Storage type of the history, one of ``HISTORY_DTYPES``.
+        line_search_fn (Optional[str]): None for fixed steps or "strong_wolfe".
+        bounds (Optional[Tuple[float, float]]): (lower, upper) bounds of every variable, None for unbounded.
+    """
+    def __init__(self, params: Iterable[torch.Tensor], lr: float=1, max_iter: int=20, max_eval: Optional[int]=None,
+                 tolerance_grad: float=1e-7, tolerance_change: float=1e-9, history_size: int=100,
+                 max_history_mb: Optional[int]=None, history_dtype: str="fp32",
+                 line_search_fn: Optional[str]=None, bounds: Optional[Tuple[float, float]]=None) -> None:
+        if history_dtype not in HISTORY_DTYPES:
+            raise ValueError(f"unknown history dtype {history_dtype}, expected one of {list(HISTORY_DTYPES)}")
+        if line_search_fn not in (None, "strong_wolfe"):
+            raise ValueError(f"unknown line search {line_search_fn}, expected None or 'strong_wolfe'")
+        if bounds is not None and line_search_fn is not None:
+            raise ValueError("bounded LBFGS uses its own projected line search")
+        if max_eval is None:
+            max_eval = max_iter * 5 // 4
+        defaults = dict(lr=lr, max_iter=max_iter, max_eval=max_eval, tolerance_grad=tolerance_grad,
+                        tolerance_change=tolerance_change, history_size=history_size,
+                        max_history_mb=max_history_mb, history_dtype=history_dtype, line_search_fn=line_search_fn,
+                        bounds=bounds)
+        super(LBFGS, self).__init__(params, defaults)
+
+        if len(self.param_groups) != 1:
+            raise ValueError("LBFGS doesn't support per-parameter options (parameter groups)")
+        self._params = self.param_groups[0]["params"]
+        self._numel_cache = None
+
+    def _numel(self) -> int:
+        if self._numel_cache is None:
+            self._numel_cache = sum(p.numel() for p in self._params)
+        return self._numel_cache
+
+    @property
+    def accepted_steps(self) -> int:
+        """
+        The number of steps taken by the optimizer so far.
+        """
+        return self.state[self._params[0]].get("accepted_steps", 0)
+
+    def history_capacity(self) -> int:
+        """
+        Returns the number of (s, y) pairs kept within the memory cap.
+        """
+        group = self.param_groups[0]
+        capacity = group["history_size"]
+        if group["max_history_mb"] is not None:
+            element_size = torch.empty((), dtype=HISTORY_DTYPES[group["history_dtype"]]).element_size()
+            pair_bytes = 2 * self._numel() * element_size
+            capacity = min(capacity, (group["max_history_mb"] << 20) // pair_bytes)
+            if capacity < 1:
+                raise ValueError(f"max_history_mb={group['max_history_mb']} cannot hold a single (s, y) pair "
+                                 f"of {pair_bytes / 2 ** 20:.1f} MB")
+        return capacity
+
+    def _gather_flat_grad(self) -> torch.Tensor:
+        views = []
+        for p in self._params:
+            if p.grad is None:
+                views.append(p.new_zeros(p.numel()))
+            else:
+                views.append(p.grad.reshape(-1))
+        return torch.cat(views, 0)
+
+    def _add_grad(self, step_size: float, update: torch.Tensor) -> None:
+        offset = 0
+        for p in self._params:
+            numel = p.numel()
+            p.add_(update[offset:offset + numel].view_as(p), alpha=step_size)
+            offset += numel
+
+    def _gather_flat_param(self) -> torch.Tensor:
+        return torch.cat([p.reshape(-1) for p in self._params], 0)
+
+    def _set_flat_param(self, flat: torch.Tensor) -> None:
+        offset = 0
+        for p in self._params:
+            numel = p.numel()
+            p.copy_(flat[offset:offset + numel].view_as(p))
+            offset += numel
+
+    def _clone_param(self) -> list:
+        return [p.clone(memory_format=torch.contiguous_format) for p in self._params]
+
+    def _set_param(self, params_data: list) -> None:
+        for p, pdata in zip(self._params, params_data):
+            p.copy_(pdata)
+
+    def _directional_evaluate(self, closure: Callable, x: list, t: float, d: torch.Tensor):
+        self._add_grad(t, d)
+        loss = float(closure())
+        flat_grad = self._gather_flat_grad()
+        self._set_param(x)
+        return loss, flat_grad
+
+    def _init_history(self, state: dict, flat_grad: torch.Tensor) -> None:
+        capacity = self.history_capacity()
+        # rows are appended by _push until the capacity is reached
+        state["old_stps"] = []
+        state["old_dirs"] = []
+        # per row magnitudes of the stored s and y, and 1 / (s . y)
+        state["scales"] = flat_grad.new_zeros((capacity, 2), dtype=torch.float32)
+        state["ro"] = flat_grad.new_zeros(capacity, dtype=torch.float32)
+        state["history_head"] = 0
+        state["history_count"] = 0
+
+    @staticmethod
+    def _dot(row: torch.Tensor, scale: torch.Tensor, vector: torch.Tensor) -> torch.Tensor:
+        return torch.dot(row.float(), vector).mul(scale)
+
+    def _push(self, state: dict, s: torch.Tensor, y: torch.Tensor) -> None:
+        """
+        Stores a curvature pair, replacing the oldest one once the rings are full.
+        """
+        dtype = HISTORY_DTYPES[self.param_groups[0]["history_dtype"]]
+        head = state["history_head"]
+        rows, scales = [], []
+        for vector in (s, y):
+            scale = vector.abs().max().clamp(min=torch.finfo(torch.float32).tiny)
+            rows.append(vector.div(scale).to(dtype))
+            scales.append(scale)
+
+        # curvature of the rounded pair keeps the recursion consistent with what is stored
+        ys = self._dot(rows[0], scales[0], rows[1].float()).mul(scales[1])
+        if ys <= 0:
+            return
+        for history, row in zip((state["old_stps"], state["old_dirs"]), rows):
+            if head < len(history):
+                history[head] = row
+            else:
+                history.append(row)
+        state["scales"][head, 0] = scales[0]
+        state["scales"][head, 1] = scales[1]
+        state["ro"][head] = 1.0 / ys
+        state["history_head"] = (head + 1) % state["ro"].numel()
+        state["history_count"] = min(state["history_count"] + 1, state["ro"].numel())
+
+    def _direction(self, state: dict, q: torch.Tensor, H_diag: torch.Tensor) -> torch.Tensor:
+        """
+        Two-loop recursion over the stored pairs, from the newest to the oldest and back.
+        """
+        capacity = state["ro"].numel()
+        count, head = state["history_count"], state["history_head"]
+        rows = [(head - count + k) % capacity for k in range(count)]
+        old_stps, old_dirs, scales, ro = state["old_stps"], state["old_dirs"], state["scales"], state["ro"]
+
+        al = [None] * count
+        for k in range(count - 1, -1, -1):
+            i = rows[k]
+            al[k] = self._dot(old_stps[i], scales[i, 0], q) * ro[i]
+            q.add_(old_dirs[i].float(), alpha=-(al[k] * scales[i, 1]))
+
+        r = q.mul_(H_diag)
+        for k in range(count):
+            i = rows[k]
+            be_i = self._dot(old_dirs[i], scales[i, 1], r) * ro[i]
+            r.add_(old_stps[i].float(), alpha=(al[k] - be_i) * scales[i, 0])
+        return r
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        super(LBFGS, self).load_state_dict(state_dict)
+        # loading casts floating point state to the parameter type, restore the history storage type
+        dtype = HISTORY_DTYPES[self.param_groups[0]["history_dtype"]]
+        for state in self.state.values():
+            for key in ("old_stps", "old_dirs"):
+                if key in state:
+                    state[key] = [row.to(dtype) for row in state[key]]
+
+    @torch.no_grad()
+    def step(self, closure: Callable) -> torch.Tensor:
+        """
+        Performs a single optimization step.
+
+        Args:
+            closure (Callable): Reevaluates the model and returns the loss.
+        """
+        closure = torch.enable_grad()(closure)
+
+        group = self.param_groups[0]
+        lr = group["lr"]
+        max_iter = group["max_iter"]
+        max_eval = group["max_eval"]
+        tolerance_grad = group["tolerance_grad"]
+        tolerance_change = group["tolerance_change"]
+        line_search_fn = group["line_search_fn"]
+
+        state = self.state[self._params[0]]
+        state.setdefault("func_evals", 0)
+        state.setdefault("n_iter", 0)
+        state.setdefault("accepted_steps", 0)
+        if group["bounds"] is not None:
+            return self._step_bounded(closure, state)
+
+        orig_loss = closure()
+        loss = float(orig_loss)
+        current_evals = 1
+        state["func_evals"] += 1
+
+        flat_grad = self._gather_flat_grad()
+        if flat_grad.abs().max() <= tolerance_grad:
+            return orig_loss
+
+        if "old_dirs" not in state:
+            self._init_history(state, flat_grad)
+        d = state.get("d")
+        t = state.get("t")
+        H_diag = state.get("H_diag")
+        prev_flat_grad = state.get("prev_flat_grad")
+        prev_loss = state.get("prev_loss")
+
+        n_iter = 0
+        while n_iter < max_iter:
+            n_iter += 1
+            state["n_iter"] += 1
+
+            # compute the direction
+            if state["n_iter"] == 1:
+                d = flat_grad.neg()
+                H_diag = 1
+                state["history_count"] = 0
+            else:
+                y = flat_grad.sub(prev_flat_grad)
+                s = d.mul(t)
+                ys = y.dot(s)
+                if ys > 1e-10:
+                    self._push(state, s, y)
+                    H_diag = ys / y.dot(y)
+                del y, s
+                d = self._direction(state, flat_grad.neg(), H_diag)
+
+            if prev_flat_grad is None:
+                prev_flat_grad = flat_grad.clone(memory_format=torch.contiguous_format)
+            else:
+                prev_flat_grad.copy_(flat_grad)
+            prev_loss = loss
+
+            # compute the step length
+            if state["n_iter"] == 1:
+                t = min(1., 1. / flat_grad.abs().sum()) * lr
+            else:
+                t = lr
+
+            # directional derivative, stop if the direction is not one of descent
+            gtd = flat_grad.dot(d)
+            if gtd > -tolerance_change:
+                break
+
+            ls_func_evals = 0
+            if line_search_fn == "strong_wolfe":
+                x_init = self._clone_param()
+
+                def obj_func(x, t, d):
+                    return self._directional_evaluate(closure, x, t, d)
+
+                loss, flat_grad, t, ls_func_evals = _strong_wolfe(obj_func, x_init, t, d, loss, flat_grad, gtd)
+                self._add_grad(t, d)
+                opt_cond = flat_grad.abs().max() <= tolerance_grad
+            else:
+                self._add_grad(t, d)
+                if n_iter != max_iter:
+                    with torch.enable_grad():
+                        loss = float(closure())
+                    flat_grad = self._gather_flat_grad()
+                    opt_cond = flat_grad.abs().max() <= tolerance_grad
+                    ls_func_evals = 1
+
+            current_evals += ls_func_evals
+            state["func_evals"] += ls_func_evals
+            state["accepted_steps"] += 1
+
+            # check conditions
+            if n_iter == max_iter:
+                break
+            if current_evals >= max_eval:
+                break
+            if opt_cond:
+                break
+            if d.mul(t).abs().max() <= tolerance_change:
+                break
+            if abs(loss - prev_loss) < tolerance_change:
+                break
+
+        state["d"] = d
+        state["t"] = t
+        state["H_diag"] = H_diag
+        state["prev_flat_grad"] = prev_flat_grad
+        state["prev_loss"] = prev_loss
+
+        return orig_loss
+
+    def _step_bounded(self, closure: Callable, state: dict, max_backtracks: int=20) -> torch.Tensor:
+        """
+        Projected L-BFGS step keeping every variable within ``bounds``.
+        """
+        group = self.param_groups[0]
+        lower, upper = group["bounds"]
+        lr = group["lr"]
+        max_iter = group["max_iter"]
+        max_eval = group["max_eval"]
+        tolerance_grad = group["tolerance_grad"]
+        tolerance_change = group["tolerance_change"]
+
+        # start from a feasible point
+        for p in self._params:
+            p.clamp_(lower, upper)
+
+        orig_loss = closure()
+        loss = float(orig_loss)
+        current_evals = 1
+        state["func_evals"] += 1
+
+        flat_grad = self._gather_flat_grad()
+        x = self._gather_flat_param()
+        if "old_dirs" not in state:
+            self._init_history(state, flat_grad)
+        H_diag = state.get("H_diag", 1)
+
+        n_iter = 0
+        while n_iter < max_iter and current_evals < max_eval:
+            n_iter += 1
+            state["n_iter"] += 1
+
+            # variables held at a bound by the gradient stay fixed
+            active = ((x <= lower) & (flat_grad > 0)) | ((x >= upper) & (flat_grad < 0))
+            projected_grad = flat_grad.masked_fill(active, 0)
+            if projected_grad.abs().max() <= tolerance_grad:
+                break
+
+            # quasi-Newton direction on the free variables, the projected gradient if it is not of descent
+            d = self._direction(state, projected_grad.neg(), H_diag).masked_fill_(active, 0)
+            if flat_grad.dot(d) > -tolerance_change:
+                d = projected_grad.neg()
+            t = min(1., 1. / projected_grad.abs().sum()) * lr if state["history_count"] == 0 else lr
+
+            # backtracking along the projected path until the Armijo condition holds
+            accepted = False
+            for _ in range(max_backtracks):
+                x_new = x.add(d, alpha=t).clamp_(lower, upper)
+                self._set_flat_param(x_new)
+                with torch.enable_grad():
+                    new_loss = float(closure())
+                current_evals += 1
+                state["func_evals"] += 1
+                if new_loss <= loss + 1e-4 * float(flat_grad.dot(x_new - x)):
+                    accepted = True
+                    break
+                if current_evals >= max_eval:
+                    break
+                t *= 0.5
+            if not accepted:
+                self._set_flat_param(x)
+                break
+            state["accepted_steps"] += 1
+
+            # curvature pair of the step actually taken
+            new_grad = self._gather_flat_grad()
+            s = x_new.sub(x)
+            y = new_grad.sub(flat_grad)
+            ys = y.dot(s)
+            if ys > 1e-10:
+                self._push(state, s, y)
+                H_diag = ys / y.dot(y)
+
+            prev_loss = loss
+            loss, flat_grad, x = new_loss, new_grad, x_new
+            if s.abs().max() <= tolerance_change:
+                break
+            if abs(loss - prev_loss) < tolerance_change:
+                break
+
+        state["H_diag"] = H_diag
+        return orig_loss
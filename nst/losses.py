@@ -2,41 +2,161 @@ import torch
 from torch import nn 
 import torch.nn.functional as F 
 
+from typing import Optional, Tuple
+
 class ContentLoss(nn.Module):
     """
     Content Loss for the neural style transfer algorithm.
+
+    For a batch of images the mean squared error is computed per sample and summed over the batch,
+    so every image is optimized as if it were on its own.
     """
     def __init__(self, target: torch.Tensor, device: torch.device) -> None:
         super(ContentLoss, self).__init__()
         batch_size, channels, height, width = target.size()
-        target = target.view(batch_size * channels, height * width)
+        target = target.view(batch_size, channels * height * width)
         self.target = target.detach().to(device)
 
     def __str__(self) -> str:
         return "Content loss"
 
-    def forward(self, input: torch.Tensor) -> torch.Tensor:
+    def forward(self, input: torch.Tensor, target: Optional[torch.Tensor]=None) -> torch.Tensor:
+        """
+        Returns the loss of ``input`` against ``target``, shaped like ``self.target``, or against
+        ``self.target`` if not given.
+        """
+        target = self.target if target is None else target
         batch_size, channels, height, width = input.size()
-        input = input.view(batch_size * channels, height * width)
-        return F.mse_loss(input, self.target)
+        input = input.view(batch_size, channels * height * width)
+        return F.mse_loss(input, target.expand_as(input), reduction="sum").div(channels * height * width)
+
+
+class GramMSE(torch.autograd.Function):
+    """
+    Fused style loss ``sum_n mean((F_n F_n^T / norm - A_n) ** 2)`` with a closed-form gradient
+    ``4 / (C^2 norm) (G_n - A_n) F_n``.
+
+    The residual is computed in place in the Gram matrix buffer, and only the features, which the
+    network keeps alive anyway, and the C x C residual are saved for backward, instead of the graph
+    of the Gram matmul and the MSE. Backward is a single matmul, where autograd would run one per
+    operand of the Gram matrix.
+
+    The analytic gradient matches the one autograd computes for the unfused loss:
+
+    >>> features = torch.randn(2, 4, 6, dtype=torch.double, requires_grad=True)
+    >>> target = torch.rand(2, 4, 4, dtype=torch.double)
+    >>> target = target + target.transpose(1, 2)
+    >>> fused = lambda f: GramMSE.apply(f, target, 24.0)
+    >>> unfused = lambda f: (torch.bmm(f, f.transpose(1, 2)) / 24.0 - target).pow(2).sum() / 16
+    >>> torch.autograd.gradcheck(fused, (features,))
+    True
+    >>> torch.allclose(torch.autograd.grad(fused(features), features)[0],
+    ...                torch.autograd.grad(unfused(features), features)[0])
+    True
+    """
+    @staticmethod
+    def forward(ctx, features: torch.Tensor, target: torch.Tensor, norm: float) -> torch.Tensor:
+        channels = features.size(1)
+        residual = torch.bmm(features, features.transpose(1, 2)).div_(norm).sub_(target)
+        ctx.save_for_backward(features, residual)
+        ctx.scale = 4.0 / (channels * channels * norm)
+        return residual.pow(2).sum().div(channels * channels)
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor) -> Tuple[torch.Tensor, None, None]:
+        features, residual = ctx.saved_tensors
+        grad = torch.bmm(residual, features).mul_(grad_output * ctx.scale)
+        return grad, None, None
 
 
 class StyleLoss(nn.Module):
     """
     Style loss for the neural style transfer algorithm.
+
+    Gram matrices are computed per sample. The target holds either one Gram matrix shared by the
+    whole batch or one per sample, and the per-sample errors are summed over the batch.
+
+    With ``fused=True`` the loss and its gradient are computed by ``GramMSE``.
+
+    With ``sample_rate < 1`` the Gram matrix of the input is estimated from a sketch of its spatial
+    positions, drawn on the first call after ``resample()`` and kept until the next one, so that all
+    evaluations of one optimizer step see the same objective: a random subset of the positions
+    (``sketch="subsample"``) or a random signed projection of all positions onto fewer buckets
+    (``sketch="countsketch"``). Both estimates are unbiased, the target stays exact.
     """
-    def __init__(self, target: torch.Tensor, device: torch.device) -> None:
+    def __init__(self, target: torch.Tensor, device: torch.device, is_gram: bool=False, fused: bool=False,
+                 sample_rate: float=1.0, sketch: str="subsample") -> None:
         super(StyleLoss, self).__init__()
-        self.target = self.compute_gram_matrix(target).detach().to(device)
+        if sketch not in ("subsample", "countsketch"):
+            raise ValueError(f"unknown sketch {sketch}, expected 'subsample' or 'countsketch'")
+        self.sample_rate = sample_rate
+        self.sketch = sketch
+        self._draw = None
+        if not is_gram:
+            target = self.compute_gram_matrix(target)
+        target = target.detach().to(device)
+        self.fused = fused
+        self.target = target
 
     def __str__(self) -> str:
         return "Style loss"
 
-    def forward(self, input: torch.Tensor) -> torch.Tensor:
-        input = self.compute_gram_matrix(input)
-        return F.mse_loss(input, self.target)
+    def forward(self, input: torch.Tensor, target: Optional[torch.Tensor]=None) -> torch.Tensor:
+        """
+        Returns the loss of ``input`` against the Gram matrices ``target``, or against ``self.target``
+        if not given.
+        """
+        target = self.target if target is None else target
+        batch_size, channels, height, width = input.size()
+        features = input.reshape(batch_size, channels, height * width)
+        norm = channels * height * width
+        if self.sample_rate < 1.0:
+            features, norm = self.sketch_features(features)
+
+        if self.fused:
+            return GramMSE.apply(features, target, norm)
+
+        gram = torch.bmm(features, features.transpose(1, 2)).div(norm)
+        return F.mse_loss(gram, target.expand_as(gram), reduction="sum").div(channels * channels)
+
+    def resample(self) -> None:
+        """
+        Discards the current sketch, the next call draws a new one.
+        """
+        self._draw = None
+
+    def sketch_features(self, features: torch.Tensor) -> Tuple[torch.Tensor, int]:
+        """
+        Sketches the spatial positions of the features, drawing the sketch if there is none yet.
+
+        Args:
+            features (torch.Tensor): Features of shape (batch, channels, positions).
+
+        Returns:
+            features (torch.Tensor): Sketched features of shape (batch, channels, samples).
+            norm (int): Normalization turning the sketched Gram matrix into an estimate of the exact one.
+        """
+        batch_size, channels, positions = features.size()
+        samples = max(1, int(round(self.sample_rate * positions)))
+        if self._draw is None or self._draw[0] != positions:
+            if self.sketch == "subsample":
+                draw = (torch.randperm(positions, device=features.device)[:samples],)
+            else:
+                buckets = torch.randint(samples, (positions,), device=features.device)
+                signs = torch.randint(2, (positions,), device=features.device, dtype=features.dtype).mul_(2).sub_(1)
+                draw = (buckets, signs)
+            self._draw = (positions,) + draw
+
+        if self.sketch == "subsample":
+            index = self._draw[1]
+            return features[:, :, index], channels * samples
+
+        buckets, signs = self._draw[1:]
+        sketched = features.new_zeros(batch_size, channels, samples).index_add(2, buckets, features * signs)
+        return sketched, channels * positions
 
-    def compute_gram_matrix(self, input: torch.Tensor) -> torch.Tensor:
+    @staticmethod
+    def compute_gram_matrix(input: torch.Tensor) -> torch.Tensor:
         batch_size, channels, height, width = input.size()
-        input = input.view(batch_size * channels, height * width)
-        return torch.matmul(input, input.T).div(batch_size * channels * height * width)
\ No newline at end of file
+        input = input.view(batch_size, channels, height * width)
+        return torch.bmm(input, input.transpose(1, 2)).div(channels * height * width)
@@ -0,0 +1,118 @@
+import json
+
+import torch
+
+from tqdm import tqdm
+
+from typing import Dict, List, Optional
+
+# columns recorded for every closure evaluation
+METRICS = ("content loss", "style loss", "total loss")
+
+
+class Reporter:
+    """
+    Receives flushed metrics. The base reporter discards them.
+    """
+    # whether train() shows a progress bar over the iterations
+    show_progress = False
+
+    def attach(self, progress: tqdm) -> None:
+        """
+        Called by train() with its progress bar.
+        """
+        pass
+
+    def report(self, evaluation: int, rows: List[Dict[str, float]]) -> None:
+        """
+        Args:
+            evaluation (int): Index of the first evaluation in ``rows``.
+            rows (List[Dict[str, float]]): The metrics of consecutive closure evaluations.
+        """
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SilentReporter(Reporter):
+    """
+    Discards all metrics.
+    """
+
+
+class TqdmReporter(Reporter):
+    """
+    Shows the latest metrics as the postfix of a tqdm progress bar.
+    """
+    show_progress = True
+
+    def __init__(self) -> None:
+        self.progress = None
+
+    def attach(self, progress: tqdm) -> None:
+        self.progress = progress
+
+    def report(self, evaluation: int, rows: List[Dict[str, float]]) -> None:
+        if self.progress is not None and rows:
+            self.progress.set_postfix(rows[-1])
+
+
+class JsonlReporter(Reporter):
+    """
+    Appends one JSON line per closure evaluation to a file.
+    """
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "a")
+
+    def report(self, evaluation: int, rows: List[Dict[str, float]]) -> None:
+        for i, row in enumerate(rows):
+            self.file.write(json.dumps({"evaluation": evaluation + i, **row}) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class MetricsRecorder:
+    """
+    Records the losses of every closure evaluation into a preallocated buffer on the device.
+
+    Recording only issues an asynchronous device copy, the buffer is read back and handed to the
+    reporter once every ``flush_every`` evaluations and on ``flush()``, so the training loop does
+    not synchronize with the device in between.
+    """
+    def __init__(self, reporter: Optional[Reporter]=None, flush_every: int=20,
+                 device: torch.device=torch.device("cpu")) -> None:
+        self.reporter = reporter if reporter is not None else SilentReporter()
+        self.flush_every = flush_every
+        self.buffer = torch.zeros(flush_every, len(METRICS), device=device)
+        self.size = 0
+        self.evaluations = 0
+
+    def record(self, *values: torch.Tensor) -> None:
+        """
+        Records the losses of one evaluation, in the order of ``METRICS``.
+        """
+        if self.buffer.device != values[0].device:
+            self.buffer = self.buffer.to(values[0].device)
+        for column, value in enumerate(values):
+            self.buffer[self.size, column].copy_(value.detach())
+        self.size += 1
+        if self.size == self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Hands the buffered metrics to the reporter.
+        """
+        if self.size == 0:
+            return
+        rows = [dict(zip(METRICS, row)) for row in self.buffer[:self.size].tolist()]
+        self.reporter.report(self.evaluations, rows)
+        self.evaluations += self.size
+        self.size = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.reporter.close()
@@ -0,0 +1,45 @@
+import torch
+from torch import nn
+
+from typing import Dict
+
+# supported execution precisions of the loss network
+DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16}
+
+
+class LossNetworkPrecision(nn.Module):
+    """
+    Runs a feature extractor in channels_last layout and/or under bfloat16 autocast.
+
+    The optimized image stays a contiguous float32 tensor, so optimizer state is unaffected: it is
+    converted to channels_last on the way in, and the tapped features are returned as contiguous
+    float32 tensors so that the Gram matrices and losses are accumulated in float32.
+
+    With ``channels_last`` the weights of ``model`` are converted in place.
+    """
+    def __init__(self, model: nn.Module, channels_last: bool=False, precision: str="fp32") -> None:
+        super(LossNetworkPrecision, self).__init__()
+        if precision not in DTYPES:
+            raise ValueError(f"unknown precision {precision}, expected one of {list(DTYPES)}")
+        if precision != "fp32" and not hasattr(torch, "autocast"):
+            raise RuntimeError(f"{precision} execution needs torch.autocast (torch>=1.10)")
+        self.model = model.to(memory_format=torch.channels_last) if channels_last else model
+        self.channels_last = channels_last
+        self.precision = precision
+
+    @property
+    def weights_version(self) -> str:
+        # targets computed at another precision differ slightly, so they are versioned apart
+        return f"{getattr(self.model, 'weights_version', None)}-{self.precision}"
+
+    def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+
+        if self.precision == "fp32":
+            outputs = self.model(x)
+        else:
+            with torch.autocast(x.device.type, dtype=DTYPES[self.precision]):
+                outputs = self.model(x)
+
+        return {tap: feature.float().contiguous() for tap, feature in outputs.items()}
@@ -1,8 +1,51 @@
 import torch
 from torch import nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+import inspect
+from typing import Tuple, Dict, Optional, Sequence
+
+# tap names of the VGG19 feature extractor in forward order
+LAYERS = (
+    "conv1_1", "conv1_2",
+    "conv2_1", "conv2_2",
+    "conv3_1", "conv3_2", "conv3_3", "conv3_4",
+    "conv4_1", "conv4_2", "conv4_3", "conv4_4",
+    "conv5_1", "conv5_2", "conv5_3", "conv5_4",
+)
+
+# the reentrant checkpoint (the only one before torch 1.11) needs a tensor input that requires grad
+# and runs backward outside the autograd graph, the non-reentrant one has neither limitation
+CHECKPOINT_KWARGS = {"preserve_rng_state": False}
+if "use_reentrant" in inspect.signature(checkpoint).parameters:
+    CHECKPOINT_KWARGS["use_reentrant"] = False
+
+def tap_scale(tap: str) -> int:
+    """
+    Returns the downsampling factor of a tap relative to the input image.
+
+    >>> tap_scale("conv4_2")
+    8
+    """
+    return 2 ** (int(tap[4]) - 1)
+
+
+def receptive_radius(tap: str) -> int:
+    """
+    Returns how many input pixels away from a position can still affect the tap at that position.
+
+    >>> receptive_radius("conv5_1")
+    61
+    """
+    block, index = int(tap[4]), int(tap[6:])
+    radius, stride = 0, 1
+    for _ in range(1, block):
+        # two 3x3 convolutions up to the pooled one, then the 2x2 max pooling
+        radius += TappedBlock.pool_from * stride + stride
+        stride *= 2
+    return radius + index * stride
 
-from typing import Tuple, Dict, Optional
 
 class Normalization(nn.Module):
     """
@@ -17,7 +60,104 @@ class Normalization(nn.Module):
         return (x - self.mean) / self.std
 
 
-class ConvBlock1(nn.Module):
+class NormalizedConv2d(nn.Conv2d):
+    """
+    Convolution over raw images with the input normalization folded into its weights and bias.
+
+    Zero padding of the normalized image is padding with the mean in raw pixel values, so the
+    convolution zero pads the raw image and adds the missing mean contribution on the border rows
+    and columns of its output, keeping the outputs of ``conv(norm(x))`` exactly.
+
+    >>> conv = nn.Conv2d(3, 4, 3, padding=1)
+    >>> mean, std = torch.tensor([0.485, 0.456, 0.406]), torch.tensor([0.229, 0.224, 0.225])
+    >>> fused, norm = NormalizedConv2d(conv, mean, std), Normalization(mean, std)
+    >>> images = [torch.rand(2, 3, height, width) for height in (1, 2, 3, 5) for width in (1, 2, 3, 5)]
+    >>> all(torch.allclose(fused(x), conv(norm(x)), atol=1e-5) for x in images)
+    True
+    """
+    def __init__(self, conv: nn.Conv2d, mean: torch.Tensor, std: torch.Tensor) -> None:
+        if conv.kernel_size != (3, 3) or conv.padding != (1, 1) or conv.stride != (1, 1):
+            raise ValueError("only 3x3 convolutions with unit stride and padding can be fused")
+        super(NormalizedConv2d, self).__init__(conv.in_channels, conv.out_channels, kernel_size=3, padding=1)
+        self.to(conv.weight)
+        mean = mean.to(conv.weight).view(1, -1, 1, 1)
+        std = std.to(conv.weight).view(1, -1, 1, 1)
+        with torch.no_grad():
+            self.weight.copy_(conv.weight / std)
+            self.bias.copy_(conv.bias - (conv.weight * mean / std).sum(dim=(1, 2, 3)))
+        self.requires_grad_(conv.weight.requires_grad)
+        self.mean = mean
+        self._borders = {}
+
+    def border(self, height: int, width: int) -> torch.Tensor:
+        """
+        Returns the padding correction of an image of at most 3x3 pixels, whose first and last
+        rows and columns are those of any larger image and whose middle row and column repeat.
+        """
+        key = (height, width, self.weight.device, self.weight.dtype)
+        if key not in self._borders:
+            with torch.no_grad():
+                # the mean on the padded ring, zero inside
+                inside = F.pad(torch.ones(1, 1, height, width).to(self.weight), (1, 1, 1, 1))
+                ring = (1 - inside) * self.mean.to(self.weight)
+                self._borders[key] = F.conv2d(ring, self.weight)[0]
+        return self._borders[key]
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        out = super(NormalizedConv2d, self).forward(x)
+        height, width = out.shape[-2:]
+        border = self.border(min(height, 3), min(width, 3)).to(out.dtype)
+
+        def row(values: torch.Tensor) -> torch.Tensor:
+            if width <= 3:
+                return values
+            middle = values[:, 1:2].expand(-1, width - 2)
+            return torch.cat([values[:, :1], middle, values[:, 2:]], dim=1)
+
+        out[:, :, 0] += row(border[:, 0])
+        if height > 1:
+            out[:, :, -1] += row(border[:, -1])
+        if height > 2:
+            out[:, :, 1:-1, 0] += border[:, 1, :1]
+            if width > 1:
+                out[:, :, 1:-1, -1] += border[:, 1, -1:]
+        return out
+
+
+class TappedBlock(nn.Module):
+    """
+    Base class for VGG19 convolution blocks that can stop at the deepest requested tap.
+    """
+    # index of the convolution whose output feeds the max pooling layer
+    pool_from = 2
+
+    def extract(self, x: torch.Tensor, taps: Sequence[int],
+                pool: bool) -> Tuple[Dict[int, torch.Tensor], Optional[torch.Tensor]]:
+        """
+        Runs the block only as deep as the requested taps and the pooled output need.
+
+        Args:
+            x (torch.Tensor): Input of the block.
+            taps (Sequence[int]): 1-based indices of the convolutions whose activations are returned.
+            pool (bool): Whether the pooled output is needed by a deeper block.
+
+        Returns:
+            features (Dict[int, torch.Tensor]): Activations of the requested convolutions.
+            out (Optional[torch.Tensor]): The pooled output, or None if it was not requested.
+        """
+        depth = max(list(taps) + ([self.pool_from] if pool else []))
+        features = {}
+        out = None
+        for i in range(1, depth + 1):
+            x = getattr(self, f"relu{i}")(getattr(self, f"conv{i}")(x))
+            if i in taps:
+                features[i] = x
+            if pool and i == self.pool_from:
+                out = self.max_pool2d(x)
+        return features, out
+
+
+class ConvBlock1(TappedBlock):
     """
     Convolution block for VGG19 [conv2d, conv2d, maxpool2d].
     """
@@ -36,7 +176,7 @@ class ConvBlock1(nn.Module):
         return conv1, conv2, out
 
 
-class ConvBlock2(nn.Module):
+class ConvBlock2(TappedBlock):
     """
     Convolution block for VGG19 [conv2d, conv2d, conv2d, conv2d, maxpool2d].
     """
@@ -64,9 +204,18 @@ class ConvBlock2(nn.Module):
 class VGG19(nn.Module):
     """
     VGG19 module with only the feature extractor.
+
+    If ``taps`` is given, the forward pass stops at the deepest requested layer and returns only
+    the requested activations keyed by tap name (e.g. ``"conv4_2"``). Otherwise all five blocks
+    are run and every activation is returned grouped by block.
+
+    With ``checkpoint_blocks`` set, the tapped forward pass is split into segments of that many
+    blocks whose intermediate activations are recomputed during backward instead of being kept,
+    so only the tapped outputs and the segment inputs stay alive.
     """
     def __init__(self, in_channels: int=3, out_channels: int=64, 
-                mean: Optional[torch.Tensor]=None, std: Optional[torch.Tensor]=None) -> None:
+                mean: Optional[torch.Tensor]=None, std: Optional[torch.Tensor]=None,
+                taps: Optional[Sequence[str]]=None, checkpoint_blocks: int=0) -> None:
         super(VGG19, self).__init__()
         self.norm = Normalization(mean=mean, std=std)
         self.conv1 = ConvBlock1(in_channels=in_channels, out_channels=out_channels)
@@ -74,8 +223,63 @@ class VGG19(nn.Module):
         self.conv3 = ConvBlock2(in_channels=out_channels * 2, out_channels=out_channels * 4)
         self.conv4 = ConvBlock2(in_channels=out_channels * 4, out_channels=out_channels * 8)
         self.conv5 = ConvBlock2(in_channels=out_channels * 8, out_channels = out_channels * 8)
-            
+        self.checkpoint_blocks = checkpoint_blocks
+        self.set_taps(taps)
+
+    def set_taps(self, taps: Optional[Sequence[str]]) -> None:
+        """
+        Sets the activations returned by the forward pass.
+
+        Args:
+            taps (Optional[Sequence[str]]): Tap names from ``LAYERS``, or None for every activation.
+        """
+        self.taps = None
+        self._plan = []
+        if taps is None:
+            return
+        unknown = [tap for tap in taps if tap not in LAYERS]
+        if unknown:
+            raise ValueError(f"unknown VGG19 taps {unknown}, expected names from {LAYERS}")
+        if not taps:
+            raise ValueError("at least one tap is required")
+        self.taps = tuple(dict.fromkeys(taps))
+
+        # (block name, {conv index: tap name}, whether the pooled output is needed) per block
+        deepest = max(int(tap[4]) for tap in self.taps)
+        for block in range(1, deepest + 1):
+            block_taps = {int(tap[6:]): tap for tap in self.taps if int(tap[4]) == block}
+            self._plan.append((f"conv{block}", block_taps, block < deepest))
+
+    def freeze(self) -> "VGG19":
+        """
+        Turns the module into a fixed loss network: the weights no longer require gradients, so
+        backward passes only compute gradients with respect to the input image.
+
+        Returns:
+            self (VGG19): The frozen module in eval mode.
+        """
+        self.requires_grad_(False)
+        return self.eval()
+
+    def fuse_normalization(self) -> "VGG19":
+        """
+        Folds the input normalization into the first convolution, which saves an elementwise pass
+        over the image and its backward on every forward. The outputs are unchanged. Weights must be
+        loaded beforehand, as the state dict then holds the folded first convolution.
+
+        Returns:
+            self (VGG19): The module with the normalization folded.
+        """
+        if not isinstance(self.norm, Normalization):
+            return self
+        self.conv1.conv1 = NormalizedConv2d(self.conv1.conv1, self.norm.mean, self.norm.std)
+        self.norm = nn.Identity()
+        return self
+
     def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]: 
+        if self.taps is not None:
+            return self._forward_taps(x)
+
         x = self.norm(x)
         conv1_1, conv1_2, out = self.conv1(x)
         conv2_1, conv2_2, out = self.conv2(out)
@@ -91,4 +295,35 @@ class VGG19(nn.Module):
             "out" : out
         }
 
-        return outputs 
\ No newline at end of file
+        return outputs
+
+    def _forward_taps(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        x = self.norm(x)
+        if self.checkpoint_blocks > 0 and torch.is_grad_enabled() and x.requires_grad:
+            return self._forward_checkpointed(x)
+
+        outputs, _ = self._run_blocks(self._plan, x)
+        return outputs
+
+    def _forward_checkpointed(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        outputs = {}
+        for start in range(0, len(self._plan), self.checkpoint_blocks):
+            steps = self._plan[start:start + self.checkpoint_blocks]
+            names = [tap for _, block_taps, _ in steps for tap in block_taps.values()]
+
+            def segment(x: torch.Tensor, steps: list=steps) -> Tuple[torch.Tensor, ...]:
+                features, out = self._run_blocks(steps, x)
+                return tuple(features.values()) + ((out,) if out is not None else ())
+
+            results = checkpoint(segment, x, **CHECKPOINT_KWARGS)
+            outputs.update(zip(names, results))
+            x = results[-1] if len(results) > len(names) else None
+        return outputs
+
+    def _run_blocks(self, steps: list, x: torch.Tensor) -> Tuple[Dict[str, torch.Tensor], Optional[torch.Tensor]]:
+        outputs = {}
+        for name, block_taps, pool in steps:
+            features, x = getattr(self, name).extract(x, list(block_taps), pool)
+            for index, tap in block_taps.items():
+                outputs[tap] = features[index]
+        return outputs, x
@@ -0,0 +1,175 @@
+import json
+import struct
+import hashlib
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+from torch import nn
+
+from nst.atomic import atomic_write
+
+from typing import Dict, Optional
+
+# VGG19 keys -> torchvision vgg19().features keys
+TORCHVISION_KEYS = {
+    "conv1.conv1.weight": "0.weight",
+    "conv1.conv1.bias": "0.bias",
+    "conv1.conv2.weight": "2.weight",
+    "conv1.conv2.bias": "2.bias",
+
+    "conv2.conv1.weight": "5.weight",
+    "conv2.conv1.bias": "5.bias",
+    "conv2.conv2.weight": "7.weight",
+    "conv2.conv2.bias": "7.bias",
+
+    "conv3.conv1.weight": "10.weight",
+    "conv3.conv1.bias": "10.bias",
+    "conv3.conv2.weight": "12.weight",
+    "conv3.conv2.bias": "12.bias",
+    "conv3.conv3.weight": "14.weight",
+    "conv3.conv3.bias": "14.bias",
+    "conv3.conv4.weight": "16.weight",
+    "conv3.conv4.bias": "16.bias",
+
+    "conv4.conv1.weight": "19.weight",
+    "conv4.conv1.bias": "19.bias",
+    "conv4.conv2.weight": "21.weight",
+    "conv4.conv2.bias": "21.bias",
+    "conv4.conv3.weight": "23.weight",
+    "conv4.conv3.bias": "23.bias",
+    "conv4.conv4.weight": "25.weight",
+    "conv4.conv4.bias": "25.bias",
+
+    "conv5.conv1.weight": "28.weight",
+    "conv5.conv1.bias": "28.bias",
+    "conv5.conv2.weight": "30.weight",
+    "conv5.conv2.bias": "30.bias",
+    "conv5.conv3.weight": "32.weight",
+    "conv5.conv3.bias": "32.bias",
+    "conv5.conv4.weight": "34.weight",
+    "conv5.conv4.bias": "34.bias",
+}
+
+# file layout: magic, little-endian uint64 header size, JSON header, float32 tensors aligned to ALIGNMENT
+MAGIC = b"NSTVGG19"
+ALIGNMENT = 64
+
+
+def save_weights(state_dict: Dict[str, torch.Tensor], path: str) -> str:
+    """
+    Writes the VGG19 conv weights to a compact file that can be memory-mapped by ``load_weights``.
+
+    Args:
+        state_dict (Dict[str, torch.Tensor]): Weights in the VGG19 key layout.
+        path (str): Path of the weight file.
+
+    Returns:
+        version (str): Content hash of the weights, stored in the file header.
+    """
+    arrays = {key: value.detach().to("cpu", torch.float32).contiguous().numpy() for key, value in state_dict.items()}
+
+    digest = hashlib.sha256()
+    entries = {}
+    offset = 0
+    for key in sorted(arrays):
+        array = arrays[key]
+        digest.update(key.encode())
+        digest.update(array.tobytes())
+        entries[key] = {"offset": offset, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    version = digest.hexdigest()[:16]
+
+    header = json.dumps({"version": version, "dtype": "float32", "tensors": entries}).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    # written next to the destination and renamed so readers never see a partial file
+    with atomic_write(path) as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for key in sorted(arrays):
+            f.seek(data_start + entries[key]["offset"])
+            f.write(arrays[key].tobytes())
+        f.truncate(data_start + offset)
+
+    return version
+
+
+def load_weights(model: nn.Module, path: str, device: torch.device=torch.device("cpu")) -> nn.Module:
+    """
+    Loads a weight file written by ``save_weights`` into VGG19.
+
+    On CPU the parameters are backed directly by a copy-on-write memory map of the file, so no
+    copy is made at load time and processes loading the same file share its pages.
+
+    Args:
+        model (nn.Module): VGG19 feature module with randomized weights.
+        path (str): Path of the weight file.
+        device (torch.device): The device to load the weights in.
+
+    Returns:
+        model (nn.Module): VGG19 module with the weights loaded.
+    """
+    mapped = np.memmap(path, dtype=np.uint8, mode="c")
+    if bytes(mapped[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not a VGG19 weight file")
+    header_size, = struct.unpack("<Q", bytes(mapped[len(MAGIC):len(MAGIC) + 8]))
+    header_end = len(MAGIC) + 8 + header_size
+    header = json.loads(bytes(mapped[len(MAGIC) + 8:header_end]).decode())
+    data_start = -(-header_end // ALIGNMENT) * ALIGNMENT
+
+    model_dict = model.state_dict()
+    missing = set(model_dict) - set(header["tensors"])
+    if missing:
+        raise KeyError(f"{path} is missing weights for {sorted(missing)}")
+
+    for key, entry in header["tensors"].items():
+        shape = tuple(entry["shape"])
+        start = data_start + entry["offset"]
+        array = mapped[start:start + 4 * int(np.prod(shape))].view(np.float32).reshape(shape)
+        tensor = torch.from_numpy(array)
+
+        module_name, name = key.rsplit(".", 1)
+        module = model
+        for attr in module_name.split("."):
+            module = getattr(module, attr)
+        param = getattr(module, name)
+        if device.type == "cpu":
+            setattr(module, name, nn.Parameter(tensor, requires_grad=param.requires_grad))
+        else:
+            param.data = tensor.to(device)
+
+    model.weights_version = header["version"]
+    return model
+
+
+def convert_torchvision_weights(path: str, source: Optional[str]=None) -> str:
+    """
+    Converts the torchvision VGG19 ImageNet weights into a weight file for ``load_weights``.
+
+    Args:
+        path (str): Path of the weight file to write.
+        source (Optional[str]): Local torchvision VGG19 checkpoint. If None, the weights are
+                                fetched through ``torchvision.models.vgg19``.
+
+    Returns:
+        version (str): Content hash of the written weights.
+    """
+    if source is None:
+        from torchvision.models import vgg19
+        pretrained_dict = vgg19(pretrained=True).features.state_dict()
+    else:
+        checkpoint = torch.load(source, map_location="cpu")
+        pretrained_dict = {key[len("features."):]: value for key, value in checkpoint.items()
+                           if key.startswith("features.")}
+
+    return save_weights({key: pretrained_dict[value] for key, value in TORCHVISION_KEYS.items()}, path)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Convert torchvision VGG19 weights into a features-only weight file.")
+    parser.add_argument("--output", default="vgg19_features.bin", type=str)
+    parser.add_argument("--source", default=None, type=str)
+    args = parser.parse_args()
+
+    version = convert_torchvision_weights(args.output, args.source)
+    print(f"wrote {args.output} (version {version})")
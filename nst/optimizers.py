@@ -0,0 +1,166 @@
+import math
+
+import torch
+import torch.optim as optim
+from torch.optim.lr_scheduler import LambdaLR
+
+from nst.lbfgs import LBFGS
+
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# optimizers of the image selectable with --optimizer
+OPTIMIZERS = ("lbfgs", "adam", "adam-lbfgs")
+
+# learning rate schedules of Adam
+SCHEDULES = ("constant", "cosine", "exponential")
+
+
+def schedule_factor(schedule: str, total_steps: int, decay: float=0.99, final: float=0.05) -> Callable[[int], float]:
+    """
+    Returns the learning rate multiplier of a schedule as a function of the step.
+
+    ``cosine`` anneals from 1 to ``final`` over ``total_steps`` and then stays there, ``exponential``
+    multiplies by ``decay`` every step.
+
+    >>> [round(schedule_factor("cosine", 4)(step), 3) for step in range(6)]
+    [1.0, 0.861, 0.525, 0.189, 0.05, 0.05]
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"unknown schedule {schedule}, expected one of {SCHEDULES}")
+    if schedule == "cosine":
+        return lambda step: final + (1 - final) * 0.5 * (1 + math.cos(math.pi * min(step / max(total_steps, 1), 1.0)))
+    if schedule == "exponential":
+        return lambda step: decay ** step
+    return lambda step: 1.0
+
+
+class ScheduledAdam(optim.Adam):
+    """
+    Adam whose learning rate follows a schedule, advanced after every step.
+    """
+    def __init__(self, params: Iterable[torch.Tensor], lr: float=0.02, schedule: str="cosine",
+                 total_steps: int=100, decay: float=0.99) -> None:
+        super(ScheduledAdam, self).__init__(params, lr=lr)
+        self.scheduler = LambdaLR(self, schedule_factor(schedule, total_steps, decay))
+
+    def step(self, closure: Optional[Callable]=None) -> Optional[torch.Tensor]:
+        loss = super(ScheduledAdam, self).step(closure)
+        self.scheduler.step()
+        return loss
+
+    def state_dict(self) -> dict:
+        state = super(ScheduledAdam, self).state_dict()
+        state["scheduler"] = self.scheduler.state_dict()
+        return state
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        state_dict = dict(state_dict)
+        self.scheduler.load_state_dict(state_dict.pop("scheduler"))
+        super(ScheduledAdam, self).load_state_dict(state_dict)
+
+
+def make_lbfgs(params: Iterable[torch.Tensor], lr: float=1, max_iter: int=20, history_size: int=100,
+               max_history_mb: Optional[int]=None, history_dtype: str="fp32", line_search_fn: Optional[str]=None,
+               bounds: Optional[Tuple[float, float]]=None) -> optim.Optimizer:
+    """
+    Returns ``torch.optim.LBFGS`` unless a memory cap, a 16-bit history or bounds need the
+    memory-bounded ``LBFGS``, so that runs without those options match the stock optimizer exactly.
+    """
+    if max_history_mb is None and history_dtype == "fp32" and bounds is None:
+        return optim.LBFGS(params, lr=lr, max_iter=max_iter, history_size=history_size, line_search_fn=line_search_fn)
+    return LBFGS(params, lr=lr, max_iter=max_iter, history_size=history_size, max_history_mb=max_history_mb,
+                 history_dtype=history_dtype, line_search_fn=line_search_fn, bounds=bounds)
+
+
+class AdamThenLBFGS:
+    """
+    Takes ``warmup_steps`` cheap Adam steps to get out of the initial region quickly, then switches
+    to L-BFGS for the fast local convergence.
+
+    ``param_groups`` are those of the L-BFGS optimizer, so evaluation budgets set on them by
+    ``train()`` apply once it takes over.
+    """
+    def __init__(self, params: Iterable[torch.Tensor], warmup_steps: int=50, adam: Optional[dict]=None,
+                 lbfgs: Optional[dict]=None) -> None:
+        params = list(params)
+        self.adam = ScheduledAdam(params, **(adam or {}))
+        self.lbfgs = make_lbfgs(params, **(lbfgs or {}))
+        self.warmup_steps = warmup_steps
+        self.steps = 0
+
+    @property
+    def param_groups(self) -> List[dict]:
+        return self.lbfgs.param_groups
+
+    @property
+    def accepted_steps(self) -> int:
+        lbfgs_steps = getattr(self.lbfgs, "accepted_steps", None)
+        if lbfgs_steps is None:
+            # torch.optim.LBFGS takes one step per iteration
+            lbfgs_steps = self.lbfgs.state[self.lbfgs.param_groups[0]["params"][0]].get("n_iter", 0)
+        return min(self.steps, self.warmup_steps) + lbfgs_steps
+
+    @property
+    def current(self) -> optim.Optimizer:
+        """
+        The optimizer taking the next step.
+        """
+        return self.adam if self.steps < self.warmup_steps else self.lbfgs
+
+    def zero_grad(self) -> None:
+        self.current.zero_grad()
+
+    def step(self, closure: Callable) -> torch.Tensor:
+        loss = self.current.step(closure)
+        self.steps += 1
+        return loss
+
+    def state_dict(self) -> dict:
+        return {"steps": self.steps, "adam": self.adam.state_dict(), "lbfgs": self.lbfgs.state_dict()}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.steps = state_dict["steps"]
+        self.adam.load_state_dict(state_dict["adam"])
+        self.lbfgs.load_state_dict(state_dict["lbfgs"])
+
+
+def build_optimizer(name: str, params: Iterable[torch.Tensor], lr: Optional[float]=None, total_steps: int=100,
+                    schedule: str="cosine", decay: float=0.99, warmup_steps: int=50, max_iter: int=20,
+                    history_size: int=100, max_history_mb: Optional[int]=None, history_dtype: str="fp32",
+                    line_search_fn: Optional[str]=None, bounds: Optional[Tuple[float, float]]=None):
+    """
+    Builds an optimizer of the image.
+
+    Args:
+        name (str): One of ``OPTIMIZERS``.
+        params (Iterable[torch.Tensor]): The parameters to optimize.
+        lr (Optional[float]): The learning rate, 1 for L-BFGS and 0.02 for Adam by default. The hybrid
+                              applies it to Adam.
+        total_steps (int): Steps the cosine schedule anneals over.
+        schedule (str): Learning rate schedule of Adam, one of ``SCHEDULES``.
+        decay (float): Per step decay of the exponential schedule.
+        warmup_steps (int): Adam steps of the hybrid before switching to L-BFGS.
+        max_iter (int): L-BFGS iterations per step.
+        history_size (int): Maximal number of L-BFGS curvature pairs.
+        max_history_mb (Optional[int]): Caps the L-BFGS history at this many MB.
+        history_dtype (str): Storage type of the L-BFGS history.
+        line_search_fn (Optional[str]): None or "strong_wolfe".
+        bounds (Optional[Tuple[float, float]]): Box constraints handled by L-BFGS, only for "lbfgs".
+
+    Returns:
+        optimizer: An optimizer with ``step(closure)``, ``zero_grad()``, ``param_groups`` and state dicts.
+    """
+    if name not in OPTIMIZERS:
+        raise ValueError(f"unknown optimizer {name}, expected one of {OPTIMIZERS}")
+    if bounds is not None and name != "lbfgs":
+        raise ValueError("only the lbfgs optimizer handles bounds")
+    lbfgs = dict(max_iter=max_iter, history_size=history_size, max_history_mb=max_history_mb,
+                 history_dtype=history_dtype, line_search_fn=line_search_fn)
+    adam = dict(lr=lr if lr is not None else 0.02, schedule=schedule, total_steps=total_steps, decay=decay)
+
+    if name == "adam":
+        return ScheduledAdam(params, **adam)
+    if name == "adam-lbfgs":
+        adam["total_steps"] = min(total_steps, warmup_steps)
+        return AdamThenLBFGS(params, warmup_steps=warmup_steps, adam=adam, lbfgs=lbfgs)
+    return make_lbfgs(params, lr=lr if lr is not None else 1, bounds=bounds, **lbfgs)
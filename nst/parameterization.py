@@ -0,0 +1,136 @@
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from typing import List
+
+# image parameterizations selectable with --parameterization, "pixel" optimizes the clamped pixels
+PARAMETERIZATIONS = ("pixel", "sigmoid", "decorrelated", "fourier", "laplacian")
+
+# square root of the color correlation of natural images, from the "Feature Visualization" work of Olah et al.
+COLOR_CORRELATION_SQRT = torch.tensor([[0.26, 0.09, 0.02],
+                                       [0.27, 0.00, -0.05],
+                                       [0.27, -0.09, 0.03]])
+COLOR_CORRELATION_SQRT = COLOR_CORRELATION_SQRT / COLOR_CORRELATION_SQRT.norm(dim=0).max()
+
+
+def logit(image: torch.Tensor, eps: float=1e-3) -> torch.Tensor:
+    image = image.clamp(eps, 1 - eps)
+    return torch.log(image / (1 - image))
+
+
+class ImageParameterization(nn.Module):
+    """
+    Base class of the spaces an image can be optimized in.
+
+    The module holds the optimized tensors as parameters and decodes them into an image in [0, 1]
+    when called. Bounding the image through the decoding, instead of clamping the pixels between
+    evaluations, keeps the optimizer's line searches and curvature estimates consistent.
+    """
+    def __init__(self, image: torch.Tensor) -> None:
+        super(ImageParameterization, self).__init__()
+        self.size = tuple(image.shape)
+
+    def decode(self) -> torch.Tensor:
+        raise NotImplementedError
+
+    def forward(self) -> torch.Tensor:
+        return self.decode()
+
+
+class SigmoidImage(ImageParameterization):
+    """
+    Pixels squashed into [0, 1] by a sigmoid.
+    """
+    def __init__(self, image: torch.Tensor) -> None:
+        super(SigmoidImage, self).__init__(image)
+        self.latent = nn.Parameter(logit(image.detach()))
+
+    def decode(self) -> torch.Tensor:
+        return torch.sigmoid(self.latent)
+
+
+class DecorrelatedImage(ImageParameterization):
+    """
+    Pixels in a decorrelated color space, mapped back to RGB before the sigmoid, so that the
+    gradient steps are not dominated by the luminance shared by the three channels.
+    """
+    def __init__(self, image: torch.Tensor) -> None:
+        super(DecorrelatedImage, self).__init__(image)
+        self.register_buffer("color", COLOR_CORRELATION_SQRT.to(image))
+        latent = torch.einsum("ij,bjhw->bihw", torch.inverse(self.color), logit(image.detach()))
+        self.latent = nn.Parameter(latent)
+
+    def decode(self) -> torch.Tensor:
+        return torch.sigmoid(torch.einsum("ij,bjhw->bihw", self.color, self.latent))
+
+
+class FourierImage(DecorrelatedImage):
+    """
+    Decorrelated image whose channels are parameterized by their 2D Fourier spectrum, scaled by the
+    inverse frequency so that coarse structure and fine detail converge at comparable rates.
+    """
+    def __init__(self, image: torch.Tensor) -> None:
+        if not hasattr(getattr(torch, "fft", None), "rfft2"):
+            raise RuntimeError("the fourier parameterization needs torch.fft (torch>=1.8)")
+        super(FourierImage, self).__init__(image)
+        height, width = self.size[-2:]
+        frequencies = torch.sqrt(torch.fft.fftfreq(height)[:, None] ** 2 + torch.fft.rfftfreq(width)[None, :] ** 2)
+        self.register_buffer("scale", 1.0 / frequencies.clamp(min=1.0 / max(height, width)).to(image))
+
+        spectrum = torch.fft.rfft2(self.latent.detach(), norm="ortho") / self.scale
+        del self.latent
+        self.spectrum = nn.Parameter(torch.view_as_real(spectrum).contiguous())
+
+    def decode(self) -> torch.Tensor:
+        spectrum = torch.view_as_complex(self.spectrum) * self.scale
+        latent = torch.fft.irfft2(spectrum, s=self.size[-2:], norm="ortho")
+        return torch.sigmoid(torch.einsum("ij,bjhw->bihw", self.color, latent))
+
+
+class LaplacianImage(ImageParameterization):
+    """
+    Image in logit space parameterized by its Laplacian pyramid. Coarser levels are scaled up, so
+    that their gradient steps move large regions at once.
+    """
+    def __init__(self, image: torch.Tensor, levels: int=4) -> None:
+        super(LaplacianImage, self).__init__(image)
+        gaussian = logit(image.detach())
+        bands: List[torch.Tensor] = []
+        for level in range(levels - 1):
+            if min(gaussian.shape[-2:]) < 2:
+                break
+            coarser = F.avg_pool2d(gaussian, 2)
+            bands.append(gaussian - self._upsample(coarser, gaussian.shape[-2:]))
+            gaussian = coarser
+        bands.append(gaussian)
+        self.bands = nn.ParameterList([nn.Parameter(band / 2 ** level) for level, band in enumerate(bands)])
+
+    @staticmethod
+    def _upsample(x: torch.Tensor, size: torch.Size) -> torch.Tensor:
+        return F.interpolate(x, size=tuple(size), mode="bilinear", align_corners=False)
+
+    def decode(self) -> torch.Tensor:
+        image = self.bands[-1] * 2 ** (len(self.bands) - 1)
+        for level in range(len(self.bands) - 2, -1, -1):
+            band = self.bands[level] * 2 ** level
+            image = band + self._upsample(image, band.shape[-2:])
+        return torch.sigmoid(image)
+
+
+def parameterize(name: str, image: torch.Tensor) -> ImageParameterization:
+    """
+    Wraps an image in [0, 1] into the given parameterization, which decodes back to it.
+
+    Args:
+        name (str): One of ``PARAMETERIZATIONS`` except "pixel".
+        image (torch.Tensor): The initial image of shape (batch, 3, height, width).
+
+    Returns:
+        parameterization (ImageParameterization): Holds the tensors to optimize.
+    """
+    classes = {"sigmoid": SigmoidImage, "decorrelated": DecorrelatedImage, "fourier": FourierImage,
+               "laplacian": LaplacianImage}
+    if name not in classes:
+        raise ValueError(f"unknown parameterization {name}, expected one of {list(classes)}")
+    return classes[name](image)
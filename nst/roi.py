@@ -0,0 +1,200 @@
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from nst.distributed import ALIGNMENT, halo_rows
+from nst.models.vgg19 import tap_scale
+
+from typing import Dict, List, Tuple
+
+# (top, left, bottom, right) in pixels, bottom and right excluded
+Box = Tuple[int, int, int, int]
+
+
+def mask_box(mask: torch.Tensor) -> Box:
+    """
+    Returns the bounding box of the nonzero pixels of a (height, width) mask.
+    """
+    rows = mask.any(dim=1).nonzero()
+    cols = mask.any(dim=0).nonzero()
+    if rows.numel() == 0:
+        raise ValueError("the region of interest mask is empty")
+    return int(rows[0]), int(cols[0]), int(rows[-1]) + 1, int(cols[-1]) + 1
+
+
+def expand_box(box: Box, margin: int, height: int, width: int) -> Box:
+    """
+    Grows a box by ``margin`` pixels on every side, out to multiples of ``ALIGNMENT`` so that
+    pooling stays aligned with the whole image, and clips it to the image.
+
+    >>> expand_box((100, 40, 120, 60), 64, 512, 512)
+    (32, 0, 192, 128)
+    """
+    top, left, bottom, right = box
+    top = max((top - margin) // ALIGNMENT * ALIGNMENT, 0)
+    left = max((left - margin) // ALIGNMENT * ALIGNMENT, 0)
+    bottom = min(-(-(bottom + margin) // ALIGNMENT) * ALIGNMENT, height)
+    right = min(-(-(right + margin) // ALIGNMENT) * ALIGNMENT, width)
+    return top, left, bottom, right
+
+
+class ROIRegion:
+    """
+    The areas of an image involved in re-stylizing a region of interest.
+
+    Editing the pixels of the region only changes the features within the receptive field of the
+    deepest tap around it, the affected area. Exact features of the affected area in turn need
+    another receptive field of context, the crop. Everything outside the affected area keeps the
+    features of the previous image.
+    """
+    def __init__(self, box: Box, height: int, width: int, taps: List[str]) -> None:
+        halo = halo_rows(taps)
+        self.box = box
+        self.size = (height, width)
+        self.affected = expand_box(box, halo, height, width)
+        self.crop = expand_box(self.affected, halo, height, width)
+
+    def cropped(self, image: torch.Tensor) -> torch.Tensor:
+        """
+        Returns the crop of a batch of full images.
+        """
+        top, left, bottom, right = self.crop
+        return image[:, :, top:bottom, left:right]
+
+    def paste(self, image: torch.Tensor, crop: torch.Tensor) -> torch.Tensor:
+        """
+        Returns a copy of a batch of full images with the crop replaced.
+        """
+        top, left, bottom, right = self.crop
+        image = image.clone()
+        image[:, :, top:bottom, left:right] = crop
+        return image
+
+    def affected_features(self, tap: str, feature: torch.Tensor) -> torch.Tensor:
+        """
+        Returns the features of the affected area from the features of the crop at a tap.
+        """
+        scale = tap_scale(tap)
+        top, left = self.crop[:2]
+        return feature[:, :, (self.affected[0] - top) // scale:(self.affected[2] - top) // scale,
+                       (self.affected[1] - left) // scale:(self.affected[3] - left) // scale]
+
+    def positions(self, tap: str) -> int:
+        """
+        Returns the number of spatial positions of the whole image at a tap.
+        """
+        scale = tap_scale(tap)
+        return (self.size[0] // scale) * (self.size[1] // scale)
+
+
+class ROIFeatures(nn.Module):
+    """
+    Runs the feature extractor on the crop of a region, and returns the features of its affected
+    area only.
+    """
+    def __init__(self, model: nn.Module, region: ROIRegion) -> None:
+        super(ROIFeatures, self).__init__()
+        self.model = model
+        self.region = region
+
+    def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        outputs = self.model(x)
+        return {tap: self.region.affected_features(tap, feature) for tap, feature in outputs.items()}
+
+
+class ROIContentLoss(nn.Module):
+    """
+    Content loss over the whole image computed from the affected area, with the error of the
+    rest of the image cached.
+    """
+    def __init__(self, target: torch.Tensor, fixed: torch.Tensor, positions: int) -> None:
+        super(ROIContentLoss, self).__init__()
+        self.target = target.detach()
+        self.fixed = fixed.detach().sum()
+        self.positions = positions
+
+    def __str__(self) -> str:
+        return "Content loss"
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        error = (input - self.target.expand_as(input)).pow(2).sum()
+        return (error + self.fixed).div(input.size(1) * self.positions)
+
+
+class ROIStyleLoss(nn.Module):
+    """
+    Style loss over the whole image, with the Gram matrices summed from the affected area and the
+    cached contribution of the rest of the image.
+    """
+    def __init__(self, target: torch.Tensor, fixed: torch.Tensor, positions: int) -> None:
+        super(ROIStyleLoss, self).__init__()
+        self.target = target.detach()
+        self.fixed = fixed.detach()
+        self.positions = positions
+
+    def __str__(self) -> str:
+        return "Style loss"
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        batch_size, channels, height, width = input.size()
+        features = input.reshape(batch_size, channels, height * width)
+        partial = torch.bmm(features, features.transpose(1, 2))
+        gram = (partial + self.fixed).div(channels * self.positions)
+        return F.mse_loss(gram, self.target.expand_as(gram), reduction="sum").div(channels * channels)
+
+
+@torch.no_grad()
+def image_sums(model: nn.Module, image: torch.Tensor, content: torch.Tensor, content_layers: List[str],
+               style_layers: List[str]) -> List[torch.Tensor]:
+    """
+    Runs the feature extractor once on the whole images and sums what the losses need from them.
+
+    Returns:
+        sums (List[torch.Tensor]): The squared content error per sample of every content layer,
+                                   then the unnormalized Gram matrices of every style layer.
+    """
+    outputs = model(image)
+    targets = model(content)
+    sums = [(outputs[layer] - targets[layer]).pow(2).flatten(1).sum(1) for layer in content_layers]
+    for layer in style_layers:
+        features = outputs[layer].flatten(2)
+        sums.append(torch.bmm(features, features.transpose(1, 2)))
+    return sums
+
+
+@torch.no_grad()
+def build_roi_losses(features: ROIFeatures, image: torch.Tensor, content: torch.Tensor, sums: List[torch.Tensor],
+                     style_grams: Dict[str, torch.Tensor],
+                     content_layers: List[str]) -> Tuple[Dict[str, ROIContentLoss], Dict[str, ROIStyleLoss]]:
+    """
+    Splits the whole image sums into the contribution of the affected area, recomputed on every
+    evaluation, and the cached contribution of the rest of the image.
+
+    Args:
+        features (ROIFeatures): The feature extractor of the crop.
+        image (torch.Tensor): The full batch of images being edited.
+        content (torch.Tensor): The full batch of content images.
+        sums (List[torch.Tensor]): The ``image_sums`` of ``image``.
+        style_grams (Dict[str, torch.Tensor]): The style gram matrices per style layer.
+        content_layers (List[str]): The content layers.
+
+    Returns:
+        content_losses (Dict[str, ROIContentLoss]): The content losses per content layer.
+        style_losses (Dict[str, ROIStyleLoss]): The style losses per style layer.
+    """
+    region = features.region
+    outputs = features(region.cropped(image))
+    content_outputs = features(region.cropped(content))
+
+    content_losses = {}
+    for layer, total in zip(content_layers, sums):
+        affected = (outputs[layer] - content_outputs[layer]).pow(2).flatten(1).sum(1)
+        content_losses[layer] = ROIContentLoss(content_outputs[layer], total - affected, region.positions(layer))
+
+    style_losses = {}
+    for (layer, gram), total in zip(style_grams.items(), sums[len(content_layers):]):
+        affected = outputs[layer].flatten(2)
+        fixed = total - torch.bmm(affected, affected.transpose(1, 2))
+        style_losses[layer] = ROIStyleLoss(gram, fixed, region.positions(layer))
+
+    return content_losses, style_losses
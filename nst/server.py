@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import socket
+import traceback
+sys.path.append(os.path.abspath(os.path.pardir))
+from argparse import ArgumentParser, Namespace
+
+import torch
+from torch import nn
+
+from nst.cli import DEFAULT_SOCKET
+from nst.train import IMAGE_SIZE, build_model, run
+
+from typing import List, Tuple
+
+
+def warm_up(model: nn.Module, device: torch.device, sizes: List[Tuple[int, int]]) -> None:
+    """
+    Runs a forward and backward pass per resolution so that the first job does not pay for
+    kernel selection and allocator warmup.
+
+    Args:
+        model (nn.Module): The frozen VGG19 feature extractor.
+        device (torch.device): The device of the model.
+        sizes (List[Tuple[int, int]]): The (height, width) resolutions to warm up.
+    """
+    for size in sizes:
+        x = torch.rand(1, 3, *size, device=device, requires_grad=True)
+        outputs = model(x)
+        sum(output.sum() for output in outputs.values()).backward()
+
+
+def handle(connection: socket.socket, model: nn.Module, device: torch.device) -> None:
+    """
+    Runs one job received on ``connection`` and replies with its outcome.
+
+    A job is a single JSON line holding the parsed command line args of ``train.py``, the reply is
+    a single JSON line with the status and the closure evaluations spent.
+    """
+    with connection, connection.makefile("rwb") as stream:
+        try:
+            args = Namespace(**json.loads(stream.readline()))
+            args.image_size = tuple(args.image_size)
+            if args.pyramid is not None:
+                args.pyramid = [(tuple(size), iterations) for size, iterations in args.pyramid]
+            budget = run(args, device, model)
+            reply = {"status": "ok", "evaluations": budget.evaluations, "elapsed": budget.elapsed(),
+                     "stop_reason": budget.stop_reason}
+        except Exception as e:
+            traceback.print_exc()
+            reply = {"status": "error", "message": f"{type(e).__name__}: {e}"}
+        stream.write((json.dumps(reply) + "\n").encode())
+        stream.flush()
+
+
+def serve(socket_path: str, model: nn.Module, device: torch.device) -> None:
+    """
+    Serves jobs on a unix socket one at a time until interrupted.
+
+    Args:
+        socket_path (str): Path of the unix socket to listen on.
+        model (nn.Module): The frozen VGG19 feature extractor shared by all jobs.
+        device (torch.device): The device of the model.
+    """
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        server.listen()
+        print(f"serving on {socket_path}")
+        while True:
+            connection, _ = server.accept()
+            handle(connection, model, device)
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Long-running style transfer worker with a preloaded VGG19.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, type=str)
+    parser.add_argument("--use_gpu", default=True, type=bool)
+    parser.add_argument("--weights", default=None, type=str)
+    parser.add_argument("--warm_sizes", default=[IMAGE_SIZE[0]], type=int, nargs="*")
+    args = parser.parse_args()
+
+    device = torch.device("cuda") if (torch.cuda.is_available() and args.use_gpu) else torch.device("cpu")
+    print(f"training on device {device}")
+
+    model = build_model(device, args.weights)
+    warm_up(model, device, [(size, size) for size in args.warm_sizes])
+
+    try:
+        serve(args.socket, model, device)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import struct
+
+import numpy as np
+import torch
+
+from torchvision import transforms
+
+from PIL import Image
+
+from typing import BinaryIO, Callable, List
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """
+    Returns the start offsets of tiles covering ``length`` pixels with at least ``overlap`` pixels of overlap.
+
+    >>> tile_starts(1000, 512, 64)
+    [0, 448, 488]
+    """
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, tile - overlap))
+    return starts + [length - tile]
+
+
+def feather_mask(height: int, width: int, overlap: int, top: bool, bottom: bool, left: bool, right: bool) -> np.ndarray:
+    """
+    Blending weights of a tile, ramping up linearly over the overlap on the sides that have a neighbour.
+
+    Args:
+        height (int): Height of the tile.
+        width (int): Width of the tile.
+        overlap (int): Width of the ramps.
+        top, bottom, left, right (bool): Whether the tile has a neighbour on that side.
+
+    Returns:
+        mask (np.ndarray): Positive weights of shape (height, width).
+    """
+    def ramp(length: int, start: bool, end: bool) -> np.ndarray:
+        weights = np.ones(length, dtype=np.float32)
+        size = min(overlap, length // 2)
+        if size > 0:
+            up = np.linspace(0.0, 1.0, size + 2, dtype=np.float32)[1:-1]
+            if start:
+                weights[:size] = up
+            if end:
+                weights[length - size:] = up[::-1]
+        return weights
+
+    return np.outer(ramp(height, top, bottom), ramp(width, left, right))
+
+
+def tiff_header(height: int, width: int) -> bytes:
+    """
+    Returns the header of an uncompressed 8-bit RGB TIFF whose strips follow it in row order, so
+    that the rows can be appended as they are finished.
+    """
+    row_bytes = width * 3
+    rows_per_strip = max(1, (1 << 16) // row_bytes)
+    strips = -(-height // rows_per_strip)
+
+    # values too large for their IFD entry follow the IFD, then the strips
+    bits_at = 8 + 2 + 12 * 12 + 4
+    resolution_at = bits_at + 6
+    offsets_at = resolution_at + 16
+    counts_at = offsets_at + 4 * strips
+    data_at = counts_at + 4 * strips
+    if data_at + height * row_bytes >= 1 << 32:
+        raise ValueError(f"a {height}x{width} image does not fit in a TIFF with 32-bit offsets")
+    offsets = [data_at + strip * rows_per_strip * row_bytes for strip in range(strips)]
+    counts = [min(rows_per_strip, height - strip * rows_per_strip) * row_bytes for strip in range(strips)]
+
+    def entry(tag: int, kind: int, count: int, value: int) -> bytes:
+        # kind 3 is SHORT, stored in the low half of the value field, 4 is LONG and 5 RATIONAL
+        return struct.pack("<HHIHH", tag, kind, count, value, 0) if kind == 3 and count == 1 \
+            else struct.pack("<HHII", tag, kind, count, value)
+
+    entries = [entry(256, 4, 1, width), entry(257, 4, 1, height), entry(258, 3, 3, bits_at), entry(259, 3, 1, 1),
+               entry(262, 3, 1, 2), entry(273, 4, strips, offsets[0] if strips == 1 else offsets_at),
+               entry(277, 3, 1, 3), entry(278, 4, 1, rows_per_strip),
+               entry(279, 4, strips, counts[0] if strips == 1 else counts_at), entry(282, 5, 1, resolution_at),
+               entry(283, 5, 1, resolution_at + 8), entry(296, 3, 1, 2)]
+    header = struct.pack("<2sHIH", b"II", 42, 8, len(entries)) + b"".join(entries) + struct.pack("<I", 0)
+    header += struct.pack("<3H4I", 8, 8, 8, 72, 1, 72, 1)
+    header += struct.pack(f"<{strips}I", *offsets) + struct.pack(f"<{strips}I", *counts)
+    return header
+
+
+def open_rows(path: str, height: int, width: int) -> BinaryIO:
+    """
+    Opens an 8-bit RGB image file that takes its rows in order from top to bottom, a binary PPM
+    or an uncompressed TIFF depending on the extension of ``path``.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".ppm":
+        header = f"P6\n{width} {height}\n255\n".encode()
+    elif extension in (".tif", ".tiff"):
+        header = tiff_header(height, width)
+    else:
+        raise ValueError(f"tiled outputs are streamed as .ppm or .tif(f), not {extension}")
+    output = open(path, "wb")
+    output.write(header)
+    return output
+
+
+def stylize_tiled(image: Image.Image, output_path: str, stylize_tile: Callable[[torch.Tensor], torch.Tensor],
+                  tile: int=512, overlap: int=64, device: torch.device=torch.device("cpu")) -> None:
+    """
+    Stylizes a large image tile by tile and blends the tiles with feathered overlaps.
+
+    Tiles are processed row by row. Blending only keeps one band of tile rows in memory, and rows
+    no later tile touches are appended to the output file as soon as their tile row is done, so the
+    network activations only depend on the tile size. The band still spans the full width of the
+    image, and ``image`` is decoded whole by PIL on the first crop.
+
+    Args:
+        image (Image.Image): The content image at output resolution.
+        output_path (str): Path to save the stylized image to, a .ppm or .tif(f) file.
+        stylize_tile (Callable): Stylizes a (1, 3, h, w) content tile in [0, 1], returning a tensor of the same size.
+        tile (int): Side of the square tiles.
+        overlap (int): Minimum overlap between neighbouring tiles.
+        device (torch.device): The device to stylize the tiles on.
+    """
+    image = image.convert("RGB")
+    width, height = image.size
+    to_tensor = transforms.ToTensor()
+
+    tops = tile_starts(height, tile, overlap)
+    lefts = tile_starts(width, tile, overlap)
+    tile_height = min(tile, height)
+    tile_width = min(tile, width)
+
+    # finished rows, streamed to the output
+    output = open_rows(output_path, height, width)
+
+    # weighted sums of the rows starting at band_top that are still being blended
+    band_top = 0
+    band = np.zeros((tile_height, width, 3), dtype=np.float32)
+    band_weights = np.zeros((tile_height, width), dtype=np.float32)
+
+    try:
+        for row, top in enumerate(tops):
+            # move the band down to this tile row, keeping the overlap with the previous one
+            shift = top - band_top
+            if shift > 0:
+                band[:tile_height - shift] = band[shift:]
+                band[tile_height - shift:] = 0
+                band_weights[:tile_height - shift] = band_weights[shift:]
+                band_weights[tile_height - shift:] = 0
+                band_top = top
+
+            for column, left in enumerate(lefts):
+                content = to_tensor(image.crop((left, top, left + tile_width, top + tile_height)))
+                stylized = stylize_tile(content.unsqueeze(0).to(device))
+                stylized = stylized.detach()[0].permute(1, 2, 0).to("cpu").numpy()
+
+                mask = feather_mask(tile_height, tile_width, overlap, top=row > 0, bottom=row < len(tops) - 1,
+                                    left=column > 0, right=column < len(lefts) - 1)
+                band[:, left:left + tile_width] += stylized * mask[..., None]
+                band_weights[:, left:left + tile_width] += mask
+
+            # rows above the next tile row are final
+            done = (tops[row + 1] - top) if row < len(tops) - 1 else tile_height
+            rows = band[:done] / band_weights[:done, :, None]
+            output.write(np.clip(rows * 255.0 + 0.5, 0, 255).astype(np.uint8).tobytes())
+    finally:
+        output.close()
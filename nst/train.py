@@ -1,12 +1,15 @@
 import os 
 import sys
+import copy
 sys.path.append(os.path.abspath(os.path.pardir))
-from argparse import ArgumentParser
+from argparse import Namespace
+from functools import partial
 
 import torch
 from torch import nn
 import torch.nn.functional as F
 import torch.optim as optim
+import torch.distributed as dist
 
 from torchvision import transforms
 from torchvision.models import vgg19
@@ -14,83 +17,424 @@ from torchvision.models import vgg19
 from PIL import Image
 import matplotlib.pyplot as plt
 
+from nst.cli import build_parser, check_args
 from nst.models.vgg19 import VGG19
+from nst.models.weights import TORCHVISION_KEYS, load_weights
+from nst.models.precision import LossNetworkPrecision
 from nst.losses import ContentLoss, StyleLoss
+from nst.layers import LayerSpec, PRESETS
+from nst.cache import TensorCache
+from nst.budget import Budget, BudgetExhausted
+from nst.metrics import MetricsRecorder, TqdmReporter, JsonlReporter, SilentReporter
+from nst.tiling import stylize_tiled
+from nst.compiled import LossCompiler
+from nst.optimizers import build_optimizer
+from nst.parameterization import ImageParameterization, parameterize
+from nst.checkpoint import Checkpointer, targets_hash
+from nst.distributed import ShardedFeatures, all_reduce_grad, build_sharded_losses, shard_rows
+from nst.roi import ROIFeatures, ROIRegion, build_roi_losses, image_sums, mask_box
 
 from tqdm import tqdm
-from typing import List, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+# (height, width) every image is resized to
+IMAGE_SIZE = (512, 512)
 
 def main() -> None:
     # command line args 
-    parser = ArgumentParser()
-    parser.add_argument("--use_gpu", default=True, type=bool)
-    parser.add_argument("--content_dir", default="../images/content/dancing.jpg", type=str)
-    parser.add_argument("--style_dir", default="../images/style/picasso.jpg", type=str)
-    parser.add_argument("--input_image", default="content", type=str)
-    parser.add_argument("--output_dir", default="../result/result.jpg", type=str)
-    parser.add_argument("--iterations", default=100, type=int)
-    parser.add_argument("--alpha", default=1, type=int)
-    parser.add_argument("--beta", default=1000000, type=int)
-    parser.add_argument("--style_layer_weight", default=1.0, type=float)
+    parser = build_parser()
     args = parser.parse_args()
+    check_args(parser, args)
 
     device = torch.device("cuda") if (torch.cuda.is_available() and args.use_gpu) else torch.device("cpu")
     print(f"training on device {device}")
 
-    # content and style images
-    content = image_loader(args.content_dir, device)
-    style = image_loader(args.style_dir, device)
+    run(args, device)
 
-    # input image
-    if args.input_image == "content":
-        x = content.clone()
-    elif args.input_image == "style":
-        x = style.clone()
-    else:
-        x = torch.randn(content.data.size(), device=device)
+def layer_spec(args: Namespace) -> LayerSpec:
+    """
+    Builds the layer spec from a preset, optionally overriding its content or style taps.
+
+    Args:
+        args (Namespace): The parsed command line args.
+
+    Returns:
+        spec (LayerSpec): The taps used by the losses and their weights.
+    """
+    if args.layers not in PRESETS:
+        raise ValueError(f"unknown layer preset {args.layers}, expected one of {list(PRESETS)}")
+    preset = PRESETS[args.layers]
+    content = dict(args.content_layers) if args.content_layers else preset.content
+    style = dict(args.style_layers) if args.style_layers else preset.style
+    return LayerSpec(content=content, style=style)
+
+def optimizer_factory(args: Namespace) -> Callable[[List[torch.Tensor]], optim.Optimizer]:
+    """
+    Builds the optimizer of the image from the command line args.
+
+    Args:
+        args (Namespace): The parsed command line args.
+
+    Returns:
+        optimizer_fn (Callable): Builds the optimizer for a list of parameters.
+    """
+    # learning rate schedules span the longest level
+    total_steps = max(iterations for _, iterations in args.pyramid) if args.pyramid is not None else args.iterations
+    return partial(build_optimizer, args.optimizer, lr=args.lr, total_steps=total_steps, schedule=args.lr_schedule,
+                   decay=args.lr_decay, warmup_steps=args.warmup_steps, max_iter=args.max_iter,
+                   history_size=args.history_size, max_history_mb=args.max_history_mb,
+                   history_dtype=args.history_dtype, line_search_fn=args.line_search, 
+                   bounds=(0.0, 1.0) if args.bounded else None)
+
+def build_model(device: torch.device, weights: Optional[str]=None, spec: LayerSpec=PRESETS["gatys"]) -> VGG19:
+    """
+    Builds the frozen VGG19 loss network, truncated after the deepest tap of the layer spec.
+
+    Args:
+        device (torch.device): The device to load the model in.
+        weights (Optional[str]): Weight file written by ``nst.models.weights``, or None to load the
+                                 torchvision weights.
+        spec (LayerSpec): The taps used by the losses.
 
+    Returns:
+        model (VGG19): The frozen VGG19 feature extractor with pretrained weights.
+    """
     # mean and std for vgg19
     mean = torch.tensor([0.485, 0.456, 0.406]).to(device)
     std = torch.tensor([0.229, 0.224, 0.225]).to(device)
 
     # vgg19 model
-    model = VGG19(mean=mean, std=std).to(device=device)
-    model = load_vgg19_weights(model, device)
-    # LBFGS optimizer like in paper
-    optimizer = optim.LBFGS([x.requires_grad_()])
+    model = VGG19(mean=mean, std=std, taps=spec.taps).to(device=device)
+    if weights is not None:
+        return load_weights(model, weights, device).freeze()
+    return load_vgg19_weights(model, device).freeze()
 
-    # computing content and style representations
-    content_outputs = model(content)
-    style_outputs = model(style)
+def run(args: Namespace, device: torch.device, model: Optional[VGG19]=None) -> Budget:
+    """
+    Runs a style transfer job described by parsed command line args and saves the results.
 
-    # defining content and style losses
-    content_loss = ContentLoss(content_outputs["conv4"][1], device)
-    style_losses = []
-    for i in range(1, 6):
-        style_losses.append(StyleLoss(style_outputs[f"conv{i}"][0], device))
+    Args:
+        args (Namespace): The parsed command line args.
+        device (torch.device): The device to train on.
+        model (Optional[VGG19]): A frozen VGG19 loss network on ``device`` to reuse, or None to build one.
+                                 Its taps are set from the layer spec of the job.
+
+    Returns:
+        budget (Budget): The budget of the run, with the closure evaluations spent.
+    """
+    # taps used by the losses
+    spec = layer_spec(args)
+
+    if model is None:
+        model = build_model(device, args.weights, spec)
+    else:
+        # the model is shared with later jobs, so a job changing its layout or weights gets its own copy
+        if args.channels_last or args.fuse_normalization:
+            model = copy.deepcopy(model)
+        model.set_taps(spec.taps)
+    # blocks per recomputed segment, 0 keeps all activations
+    model.checkpoint_blocks = args.activation_checkpointing
+    # normalization folded into conv1_1, the outputs are unchanged
+    if args.fuse_normalization:
+        model.fuse_normalization()
+
+    # execution layout and precision of the loss network
+    network = model
+    if args.channels_last or args.precision != "fp32":
+        network = LossNetworkPrecision(model, channels_last=args.channels_last, precision=args.precision)
+
+    # style gram matrices, looked up in the on-disk cache if enabled
+    cache = TensorCache(args.cache_dir, args.cache_size_mb << 20) if args.cache_dir is not None else None
+
+    # stopping rules and loss reporting
+    budget = Budget(max_evals=args.max_evals, max_time=args.max_time, tol=args.tol, window=args.tol_window)
+    # only process 0 of a distributed run reports, the others must not open the metrics file
+    if args.distributed and not dist.is_initialized():
+        dist.init_process_group("gloo")
+    if args.distributed and dist.get_rank() != 0:
+        reporter = SilentReporter()
+    elif args.reporter == "jsonl":
+        reporter = JsonlReporter(args.metrics_path)
+    elif args.reporter == "silent":
+        reporter = SilentReporter()
+    else:
+        reporter = TqdmReporter()
+    metrics = MetricsRecorder(reporter, flush_every=args.report_every, device=device)
+
+    # whole loss compiled into one graph per image size, artifacts kept in the style cache
+    compiler = LossCompiler(args.compile_loss, cache) if args.compile_loss is not None else None
+
+    if args.tile_size is not None:
+        run_tiled(args, device, network, spec, cache, budget, metrics, compiler)
+        metrics.close()
+        print(budget)
+        return budget
+
+    if args.distributed:
+        run_distributed(args, device, network, spec, cache, budget, metrics)
+        metrics.close()
+        if dist.get_rank() == 0:
+            print(budget)
+        return budget
+
+    if args.roi_base is not None:
+        run_roi(args, device, network, spec, cache, budget, metrics)
+        metrics.close()
+        print(budget)
+        return budget
+
+    # (size, iterations) per resolution level, a single level at the image size by default
+    levels = args.pyramid if args.pyramid is not None else [(args.image_size, args.iterations)]
+
+    # previous results of the same content/style pairs, refined for a few iterations instead of starting over
+    previous = None
+    if args.warm_start:
+        keys = result_keys(cache, args.content_dir, args.style_dir, levels[-1][0], 
+                           getattr(network, "weights_version", None))
+        previous = load_results(cache, keys, device)
+        if previous is not None:
+            levels = [(levels[-1][0], args.refine_iterations)]
+
+    # content images at the first level, batched along the first dimension, not needed to refine previous results
+    content = batch_loader(args.content_dir, device, levels[0][0]) if previous is None else None
 
-    # run style transfer
-    output = train(model, optimizer, content_loss, style_losses, x,
-                   iterations=args.iterations, alpha=args.alpha, beta=args.beta, 
-                   style_weight=args.style_layer_weight)
+    # input image
+    x = previous if previous is not None else initial_image(args, content, device, levels[0][0])
+
+    def make_losses(size: Tuple[int, int]) -> Tuple[Dict[str, ContentLoss], Dict[str, StyleLoss]]:
+        # defining content and style losses at the given resolution
+        style_grams = load_style_grams(network, args.style_dir, device, list(spec.style), cache, size)
+        level_content = None
+        content_targets = None
+        if args.warm_start:
+            # cached features, the content images are only decoded on a miss
+            content_targets = load_content_targets(network, args.content_dir, device, list(spec.content), cache, size)
+        elif tuple(content.shape[-2:]) == tuple(size):
+            level_content = content
+        else:
+            level_content = batch_loader(args.content_dir, device, size)
+        return build_losses(network, level_content, style_grams, device, list(spec.content), 
+                            fused_style=args.fused_style_loss, style_sample_rate=args.style_sample_rate, 
+                            style_sketch=args.style_sketch, content_targets=content_targets)
+
+    # periodic checkpoints of the optimization, optionally resuming from the last one
+    checkpoint = None
+    if args.checkpoint_path is not None:
+        checkpoint = Checkpointer(args.checkpoint_path, every=args.checkpoint_every, resume=args.resume)
+
+    # run style transfer, with LBFGS optimizer like in paper by default
+    output = train_pyramid(network, make_losses, x, levels, optimizer_fn=optimizer_factory(args), spec=spec,
+                           alpha=args.alpha, beta=args.beta, style_weight=args.style_layer_weight, 
+                           budget=budget, metrics=metrics, compiler=compiler, 
+                           parameterization=args.parameterization, checkpoint=checkpoint)
+    if checkpoint is not None:
+        checkpoint.close()
+    metrics.close()
     output = output.detach().to("cpu")
+    print(budget)
+
+    if args.warm_start:
+        for key, image in zip(keys, output):
+            cache.store(key, [image.unsqueeze(0)])
+
+    # save results
+    for output_dir, image in zip(args.output_dir, output):
+        plt.imsave(output_dir, image.permute(1, 2, 0).numpy())
+
+    return budget
 
-    # save result
-    plt.imsave(args.output_dir, output[0].permute(1, 2, 0).numpy())
+def run_tiled(args: Namespace, device: torch.device, model: nn.Module, spec: LayerSpec, cache: Optional[TensorCache],
+              budget: Budget, metrics: MetricsRecorder, compiler: Optional[LossCompiler]=None) -> None:
+    """
+    Stylizes each content image at its native resolution in overlapping tiles.
+
+    The style gram matrices are computed once at the tile size and shared by all tiles, so the
+    style statistics stay consistent across the image while content targets are computed per tile.
 
-def image_loader(path: str, device: torch.device=torch.device("cuda")) -> torch.Tensor:
+    Args:
+        args (Namespace): The parsed command line args.
+        device (torch.device): The device to train on.
+        model (nn.Module): The frozen VGG19 loss network.
+        spec (LayerSpec): The taps used by the losses.
+        cache (Optional[TensorCache]): The gram matrix cache, or None to always compute them.
+        budget (Budget): Budgets shared by all tiles.
+        metrics (MetricsRecorder): Records the losses of every closure evaluation.
+        compiler (Optional[LossCompiler]): Compiles the loss once for all tiles of the same size.
+    """
+    tile_size = (args.tile_size, args.tile_size)
+    style_grams = load_style_grams(model, args.style_dir, device, list(spec.style), cache, tile_size)
+
+    for index, (content_dir, output_dir) in enumerate(zip(args.content_dir, args.output_dir)):
+        # gram matrices of the style image paired with this content image
+        grams = {layer: gram[index:index + 1] if gram.size(0) > 1 else gram for layer, gram in style_grams.items()}
+
+        def stylize_tile(tile: torch.Tensor) -> torch.Tensor:
+            content_losses, style_losses = build_losses(model, tile, grams, device, list(spec.content), 
+                                                        fused_style=args.fused_style_loss, 
+                                                        style_sample_rate=args.style_sample_rate, 
+                                                        style_sketch=args.style_sketch)
+            if args.parameterization == "pixel":
+                x = tile.clone().requires_grad_()
+                optimizer = optimizer_factory(args)([x])
+            else:
+                x = parameterize(args.parameterization, tile)
+                optimizer = optimizer_factory(args)(list(x.parameters()))
+            return train(model, optimizer, content_losses, style_losses, x, iterations=args.iterations, 
+                         alpha=args.alpha, beta=args.beta, style_weight=args.style_layer_weight, spec=spec, 
+                         budget=budget, metrics=metrics, compiler=compiler)
+
+        stylize_tiled(Image.open(content_dir), output_dir, stylize_tile, tile=args.tile_size, 
+                      overlap=args.tile_overlap, device=device)
+
+def run_distributed(args: Namespace, device: torch.device, model: nn.Module, spec: LayerSpec, 
+                    cache: Optional[TensorCache], budget: Budget, metrics: MetricsRecorder) -> None:
+    """
+    Stylizes the content images with the image rows sharded across the processes of a gloo group.
+
+    Every process holds the full image and runs the same optimizer, but only runs the network on
+    its own rows plus a halo covering the receptive field of the deepest tap. Partial Gram matrices
+    and content errors are all-reduced into the global losses and the image gradients are
+    all-reduced after backward, so all processes take identical steps. Expects the usual
+    ``torch.distributed`` environment variables, e.g. as set by ``torchrun``. Process 0 saves the results.
+
+    Args:
+        args (Namespace): The parsed command line args.
+        device (torch.device): The device to train on.
+        model (nn.Module): The frozen VGG19 loss network.
+        spec (LayerSpec): The taps used by the losses.
+        cache (Optional[TensorCache]): The gram matrix cache, or None to always compute them.
+        budget (Budget): Evaluation budget and convergence tolerance.
+        metrics (MetricsRecorder): Records the losses of every closure evaluation on process 0.
+    """
+    if not dist.is_initialized():
+        dist.init_process_group("gloo")
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    if rank != 0:
+        metrics = MetricsRecorder(SilentReporter(), device=device)
+
+    height = args.image_size[0]
+    content = batch_loader(args.content_dir, device, args.image_size)
+    style_grams = load_style_grams(model, args.style_dir, device, list(spec.style), cache, args.image_size)
+
+    start, end = shard_rows(height, rank, world_size)
+    features = ShardedFeatures(model, start, end, height, spec.taps)
+    content_losses, style_losses = build_sharded_losses(features, content, style_grams, list(spec.content), height)
+
+    # input image, identical on all processes
+    x = initial_image(args, content, device, args.image_size)
+    dist.broadcast(x, 0)
+
+    x.requires_grad_().register_hook(all_reduce_grad)
+    optimizer = optimizer_factory(args)([x])
+    output = train(features, optimizer, content_losses, style_losses, x, iterations=args.iterations, 
+                   alpha=args.alpha, beta=args.beta, style_weight=args.style_layer_weight, spec=spec, 
+                   budget=budget, metrics=metrics)
+
+    if rank == 0:
+        output = output.detach().to("cpu")
+        for output_dir, image in zip(args.output_dir, output):
+            plt.imsave(output_dir, image.permute(1, 2, 0).numpy())
+
+def run_roi(args: Namespace, device: torch.device, model: nn.Module, spec: LayerSpec, cache: Optional[TensorCache], 
+            budget: Budget, metrics: MetricsRecorder) -> None:
+    """
+    Re-stylizes a region of interest of a previous result, leaving the rest of it untouched.
+
+    Only a crop around the region, grown by twice the receptive field of the deepest tap, goes
+    through the network on every evaluation. The Gram matrices and content errors of the whole
+    previous result are computed once, or looked up in the cache, and the part outside the area
+    the region can affect stays fixed, so the losses still match the global targets while the
+    cost of an evaluation scales with the region rather than the image.
+
+    Args:
+        args (Namespace): The parsed command line args.
+        device (torch.device): The device to train on.
+        model (nn.Module): The frozen VGG19 loss network.
+        spec (LayerSpec): The taps used by the losses.
+        cache (Optional[TensorCache]): The gram matrix cache, or None to always compute them.
+        budget (Budget): Evaluation budget and convergence tolerance.
+        metrics (MetricsRecorder): Records the losses of every closure evaluation.
+    """
+    height, width = args.image_size
+    # results saved as PNG carry an alpha channel
+    image = image_loader(args.roi_base, device, args.image_size)[:, :3]
+    content = image_loader(args.content_dir[0], device, args.image_size)
+
+    # editable pixels
+    if args.roi_mask is not None:
+        mask = image_loader(args.roi_mask, device, args.image_size)[:, :3].mean(dim=1, keepdim=True)
+        mask = mask.gt(0.5).to(image.dtype)
+    else:
+        top, left, bottom, right = args.roi
+        mask = torch.zeros_like(image[:, :1])
+        mask[:, :, top:bottom, left:right] = 1
+    region = ROIRegion(mask_box(mask[0, 0]), height, width, spec.taps)
+    features = ROIFeatures(model, region)
+
+    # sums over the whole previous result, looked up in the cache if enabled
+    key = None
+    sums = None
+    if cache is not None:
+        with open(args.roi_base, "rb") as image_file, open(args.content_dir[0], "rb") as content_file:
+            key = cache.make_key("roi", image_file.read(), content_file.read(), tuple(args.image_size), 
+                                 list(spec.content), list(spec.style), getattr(model, "weights_version", None))
+        sums = cache.load(key)
+    if sums is None:
+        sums = image_sums(model, image, content, list(spec.content), list(spec.style))
+        if cache is not None:
+            cache.store(key, sums)
+    sums = [total.to(device) for total in sums]
+
+    style_grams = load_style_grams(model, args.style_dir, device, list(spec.style), cache, args.image_size)
+    content_losses, style_losses = build_roi_losses(features, image, content, sums, style_grams, list(spec.content))
+
+    # the crop is optimized, but only the masked pixels get a gradient
+    crop_mask = region.cropped(mask)
+    x = region.cropped(image).clone().requires_grad_()
+    x.register_hook(lambda grad: grad * crop_mask)
+    optimizer = optimizer_factory(args)([x])
+    crop = train(features, optimizer, content_losses, style_losses, x, iterations=args.iterations, 
+                 alpha=args.alpha, beta=args.beta, style_weight=args.style_layer_weight, spec=spec, 
+                 budget=budget, metrics=metrics)
+
+    output = region.paste(image, crop.detach()).to("cpu")
+    plt.imsave(args.output_dir[0], output[0].permute(1, 2, 0).numpy())
+
+def initial_image(args: Namespace, content: torch.Tensor, device: torch.device, size: Tuple[int, int]) -> torch.Tensor:
+    """
+    Returns the batch of images the optimization starts from, as selected by ``--input_image``.
+
+    Args:
+        args (Namespace): The parsed command line args.
+        content (torch.Tensor): The batch of content images at ``size``.
+        device (torch.device): The device to load the images in.
+        size (Tuple[int, int]): (height, width) of the images.
+
+    Returns:
+        x (torch.Tensor): The content images, the style images repeated over the batch or noise.
+    """
+    if args.input_image == "content":
+        return content.clone()
+    if args.input_image == "style":
+        style = batch_loader(args.style_dir, device, size)
+        return style.repeat(content.size(0) // style.size(0), 1, 1, 1)
+    return torch.randn(content.data.size(), device=device)
+
+def image_loader(path: str, device: torch.device=torch.device("cuda"), 
+                 size: Tuple[int, int]=IMAGE_SIZE) -> torch.Tensor:
     """
     Loads and resizes the image.
 
     Args:
         path (str): Path to the image.
         device (torch.device): device to load the image in.
+        size (Tuple[int, int]): (height, width) to resize the image to.
 
     Returns:
         img (torch.Tensor): Loaded image as torch.Tensor.
     """
     transform = transforms.Compose([
-                    transforms.Resize((512, 512)),
+                    transforms.Resize(size),
                     transforms.ToTensor(),
                 ])
     img = Image.open(path)
@@ -98,6 +442,175 @@ def image_loader(path: str, device: torch.device=torch.device("cuda")) -> torch.
     img = img.unsqueeze(0).to(device=device)
     return img
 
+def batch_loader(paths: List[str], device: torch.device=torch.device("cuda"), 
+                 size: Tuple[int, int]=IMAGE_SIZE) -> torch.Tensor:
+    """
+    Loads and resizes several images into one batch.
+
+    Args:
+        paths (List[str]): Paths to the images.
+        device (torch.device): device to load the images in.
+        size (Tuple[int, int]): (height, width) to resize the images to.
+
+    Returns:
+        batch (torch.Tensor): Loaded images stacked along the batch dimension.
+    """
+    return torch.cat([image_loader(path, device, size) for path in paths])
+
+@torch.no_grad()
+def build_losses(model: nn.Module, content: Optional[torch.Tensor], style_grams: Dict[str, torch.Tensor], 
+                 device: torch.device, content_layers: List[str], 
+                 fused_style: bool=False, style_sample_rate: float=1.0, style_sketch: str="subsample", 
+                 content_targets: Optional[Dict[str, torch.Tensor]]=None
+                 ) -> Tuple[Dict[str, ContentLoss], Dict[str, StyleLoss]]:
+    """
+    Computes the content target without building an autograd graph and wraps the targets in losses.
+
+    Only the detached targets held by the returned losses outlive this call, the intermediate
+    activations of the forward pass are released on return.
+
+    Args:
+        model (nn.Module): The frozen VGG19 feature extractor.
+        content (Optional[torch.Tensor]): The batch of content images, None if ``content_targets`` are given.
+        style_grams (Dict[str, torch.Tensor]): The style gram matrices per style layer, shared by the
+                                               whole batch or one per content image.
+        device (torch.device): The device to keep the targets on.
+        content_layers (List[str]): The content layers.
+        fused_style (bool): Whether to use the fused Gram-MSE style loss.
+        style_sample_rate (float): Fraction of the spatial positions sketched by the style losses, 1.0 for exact losses.
+        style_sketch (str): The sketch used below a sample rate of 1.0, "subsample" or "countsketch".
+        content_targets (Optional[Dict[str, torch.Tensor]]): Precomputed content features per content layer,
+                                                             which skip the forward pass of ``content``.
+
+    Returns:
+        content_losses (Dict[str, ContentLoss]): The content losses for the content images per content layer.
+        style_losses (Dict[str, StyleLoss]): The style losses for the style images per style layer.
+    """
+    content_outputs = content_targets if content_targets is not None else model(content)
+    content_losses = {}
+    for layer in content_layers:
+        content_losses[layer] = ContentLoss(content_outputs[layer], device)
+
+    style_losses = {}
+    for layer, gram in style_grams.items():
+        style_losses[layer] = StyleLoss(gram, device, is_gram=True, fused=fused_style, 
+                                        sample_rate=style_sample_rate, sketch=style_sketch)
+
+    return content_losses, style_losses
+
+@torch.no_grad()
+def compute_style_grams(model: nn.Module, style: torch.Tensor, style_layers: List[str]) -> List[torch.Tensor]:
+    """
+    Computes the style gram matrices without building an autograd graph.
+
+    Args:
+        model (nn.Module): The frozen VGG19 feature extractor.
+        style (torch.Tensor): The batch of style images.
+        style_layers (List[str]): The style layers.
+
+    Returns:
+        style_grams (List[torch.Tensor]): The gram matrices of the style images, one per style layer.
+    """
+    style_outputs = model(style)
+    return [StyleLoss.compute_gram_matrix(style_outputs[layer]) for layer in style_layers]
+
+def load_style_grams(model: nn.Module, paths: List[str], device: torch.device, style_layers: List[str], 
+                     cache: Optional[TensorCache]=None, size: Tuple[int, int]=IMAGE_SIZE) -> Dict[str, torch.Tensor]:
+    """
+    Loads the style gram matrices of several style images, reusing cached ones where possible.
+
+    The cache key covers the raw bytes of the style image, the resize resolution, the style layers
+    and the weight version, so a hit skips both decoding the image and the forward pass.
+
+    Args:
+        model (nn.Module): The frozen VGG19 feature extractor.
+        paths (List[str]): Paths to the style images.
+        device (torch.device): The device to load the gram matrices in.
+        style_layers (List[str]): The style layers.
+        cache (Optional[TensorCache]): The gram matrix cache, or None to always compute them.
+        size (Tuple[int, int]): (height, width) to resize the style images to.
+
+    Returns:
+        style_grams (Dict[str, torch.Tensor]): The gram matrices of all style images batched along the
+                                               first dimension, per style layer.
+    """
+    per_image = []
+    for path in paths:
+        key = None
+        grams = None
+        if cache is not None:
+            with open(path, "rb") as f:
+                key = cache.make_key(f.read(), tuple(size), style_layers, getattr(model, "weights_version", None))
+            grams = cache.load(key)
+
+        if grams is None:
+            grams = compute_style_grams(model, image_loader(path, device, size), style_layers)
+            if cache is not None:
+                cache.store(key, grams)
+
+        per_image.append([gram.to(device) for gram in grams])
+
+    return {layer: torch.cat(layer_grams) for layer, layer_grams in zip(style_layers, zip(*per_image))}
+
+def load_content_targets(model: nn.Module, paths: List[str], device: torch.device, content_layers: List[str], 
+                         cache: TensorCache, size: Tuple[int, int]=IMAGE_SIZE) -> Dict[str, torch.Tensor]:
+    """
+    Loads the content features of several content images, reusing cached ones where possible.
+
+    Args:
+        model (nn.Module): The frozen VGG19 feature extractor.
+        paths (List[str]): Paths to the content images.
+        device (torch.device): The device to load the features in.
+        content_layers (List[str]): The content layers.
+        cache (TensorCache): The target cache.
+        size (Tuple[int, int]): (height, width) to resize the content images to.
+
+    Returns:
+        content_targets (Dict[str, torch.Tensor]): The features of all content images batched along the
+                                                   first dimension, per content layer.
+    """
+    per_image = []
+    for path in paths:
+        with open(path, "rb") as f:
+            key = cache.make_key("content", f.read(), tuple(size), content_layers, 
+                                 getattr(model, "weights_version", None))
+        features = cache.load(key)
+        if features is None:
+            with torch.no_grad():
+                outputs = model(image_loader(path, device, size))
+            features = [outputs[layer] for layer in content_layers]
+            cache.store(key, features)
+        per_image.append([feature.to(device) for feature in features])
+
+    return {layer: torch.cat(features) for layer, features in zip(content_layers, zip(*per_image))}
+
+def result_keys(cache: TensorCache, content_paths: List[str], style_paths: List[str], size: Tuple[int, int], 
+                weights_version: Optional[str]) -> List[str]:
+    """
+    Returns the cache keys of the results of each content image paired with its style image.
+
+    The keys leave out the loss weights and layers, so that runs only tweaking those find the result
+    of the previous run.
+    """
+    keys = []
+    for index, content_path in enumerate(content_paths):
+        style_path = style_paths[index] if len(style_paths) > 1 else style_paths[0]
+        with open(content_path, "rb") as content_file, open(style_path, "rb") as style_file:
+            keys.append(cache.make_key("result", content_file.read(), style_file.read(), tuple(size), weights_version))
+    return keys
+
+def load_results(cache: TensorCache, keys: List[str], device: torch.device) -> Optional[torch.Tensor]:
+    """
+    Returns the batch of previous results, or None unless every image has one.
+    """
+    results = []
+    for key in keys:
+        result = cache.load(key)
+        if result is None:
+            return None
+        results.append(result[0].to(device))
+    return torch.cat(results)
+
 def load_vgg19_weights(model: nn.Module, device: torch.device) -> nn.Module:
     """
     Loads VGG19 pretrained weights from ImageNet for style transfer.
@@ -111,119 +624,236 @@ def load_vgg19_weights(model: nn.Module, device: torch.device) -> nn.Module:
     """
     pretrained_model = vgg19(pretrained=True).features.to(device).eval()
 
-    matching_keys = {
-        "conv1.conv1.weight": "0.weight",
-        "conv1.conv1.bias": "0.bias",
-        "conv1.conv2.weight": "2.weight",
-        "conv1.conv2.bias": "2.bias",
-
-        "conv2.conv1.weight": "5.weight",
-        "conv2.conv1.bias": "5.bias",
-        "conv2.conv2.weight": "7.weight",
-        "conv2.conv2.bias": "7.bias",
-
-        "conv3.conv1.weight": "10.weight",
-        "conv3.conv1.bias": "10.bias",
-        "conv3.conv2.weight": "12.weight",
-        "conv3.conv2.bias": "12.bias",
-        "conv3.conv3.weight": "14.weight",
-        "conv3.conv3.bias": "14.bias",
-        "conv3.conv4.weight": "16.weight",
-        "conv3.conv4.bias": "16.bias",
-
-        "conv4.conv1.weight": "19.weight",
-        "conv4.conv1.bias": "19.bias",
-        "conv4.conv2.weight": "21.weight",
-        "conv4.conv2.bias": "21.bias",
-        "conv4.conv3.weight": "23.weight",
-        "conv4.conv3.bias": "23.bias",
-        "conv4.conv4.weight": "25.weight",
-        "conv4.conv4.bias": "25.bias",
-
-        "conv5.conv1.weight": "28.weight",
-        "conv5.conv1.bias": "28.bias",
-        "conv5.conv2.weight": "30.weight",
-        "conv5.conv2.bias": "30.bias",
-        "conv5.conv3.weight": "32.weight",
-        "conv5.conv3.bias": "32.bias",
-        "conv5.conv4.weight": "34.weight",
-        "conv5.conv4.bias": "34.bias",
-    }
-
     pretrained_dict = pretrained_model.state_dict()
     model_dict = model.state_dict()
 
-    for key, value in matching_keys.items():
+    for key, value in TORCHVISION_KEYS.items():
         model_dict[key] = pretrained_dict[value]
     
     model.load_state_dict(model_dict)
+    model.weights_version = "torchvision-vgg19"
 
     return model
 
 
-def train(model: nn.Module, optimizer: torch.optim, content_loss: ContentLoss, style_losses: List[StyleLoss], 
-          x: torch.Tensor, iterations: int=100, alpha: int=1, beta: int=1000000, style_weight: Union[int, float]=1.0) -> torch.Tensor:
+def train(model: nn.Module, optimizer: torch.optim, content_losses: Dict[str, ContentLoss], 
+          style_losses: Dict[str, StyleLoss], 
+          x: Union[torch.Tensor, ImageParameterization], iterations: int=100, alpha: int=1, beta: int=1000000, 
+          style_weight: Union[int, float]=1.0, spec: LayerSpec=PRESETS["gatys"], budget: Optional[Budget]=None, 
+          metrics: Optional[MetricsRecorder]=None, compiler: Optional[LossCompiler]=None, 
+          checkpoint: Optional[Checkpointer]=None) -> torch.Tensor:
     """
     Train the neural style transfer algorithm.
 
     Args:
         model (nn.Module): The VGG19 feature extractor for training the style transfer algorithm.
         optimizer (torch.optim): The optimization module to use.
-        content_loss (ContentLoss): The content loss to preserve the content representation during style transfer.
-        style_losses (List[StyleLoss]): A list of style loss objects to preserve the style representation across 
-                                        different layers during style transfer.
-        x (torch.Tensor): The input image for style transfer.
+        content_losses (Dict[str, ContentLoss]): The content losses per layer to preserve the content representation 
+                                                 during style transfer.
+        style_losses (Dict[str, StyleLoss]): The style losses per layer to preserve the style representation across 
+                                             different layers during style transfer.
+        x (Union[torch.Tensor, ImageParameterization]): The batch of input images for style transfer, optimized 
+                                                         jointly in one forward/backward pass per closure evaluation. 
+                                                         Pixels are clamped to [0, 1] before every evaluation, a 
+                                                         parameterization is decoded instead.
         iterations (int): Number of iterations to run.
         alpha (int): The weight given to content loss while computing the total loss.
         beta (int): The weight given to style loss while computing the total loss.
         style_weight Union[int, float]: The weight given to style loss of each layer while computing total style loss.
+        spec (LayerSpec): The content and style layers and their weights, the model must return their taps.
+        budget (Optional[Budget]): Evaluation and time budgets and convergence tolerance. Counts the
+                                   closure evaluations spent.
+        metrics (Optional[MetricsRecorder]): Records the losses of every closure evaluation without 
+                                             synchronizing with the device. Defaults to a tqdm reporter.
+        compiler (Optional[LossCompiler]): Compiles the whole loss into one graph, or None to run it eagerly.
+        checkpoint (Optional[Checkpointer]): Saves the optimization state every ``checkpoint.every`` 
+                                             iterations, and restores a resumed one first.
 
     Returns:
         x (torch.Tensor): The input image with the content and style transfered.
     """
-
-    with tqdm(range(iterations)) as iterations:
+    image = x if isinstance(x, ImageParameterization) else None
+    if image is not None:
+        # initial decoded image, for its device and shape
+        with torch.no_grad():
+            x = image()
+
+    budget = budget if budget is not None else Budget()
+    budget.begin()
+    metrics = metrics if metrics is not None else MetricsRecorder(TqdmReporter(), device=x.device)
+    loss_fn = None
+    if compiler is not None:
+        loss_fn = compiler(model, spec, content_losses, style_losses, x, alpha, beta, style_weight)
+
+    # closure evaluations per step, capped by the remaining evaluation budget
+    max_evals = [group.get("max_eval") for group in optimizer.param_groups]
+
+    # continue a resumed run, the restored optimizer must not keep the evaluation cap it was saved with
+    start = 0
+    if checkpoint is not None:
+        targets = targets_hash(content_losses, style_losses)
+        start = checkpoint.restore(x if image is None else image, optimizer, budget, metrics, targets)
+        for group, max_eval in zip(optimizer.param_groups, max_evals):
+            if max_eval is not None:
+                group["max_eval"] = max_eval
+
+    # bounded optimizers keep the pixels in [0, 1] themselves
+    bounded = any(group.get("bounds") is not None for group in optimizer.param_groups)
+    accepted_steps = getattr(optimizer, "accepted_steps", None)
+    params = [x] if image is None else list(image.parameters())
+
+    with tqdm(range(start, iterations), disable=not metrics.reporter.show_progress) as iterations:
+        metrics.reporter.attach(iterations)
         for iteration in iterations:
+            if budget.exhausted():
+                break
             iterations.set_description(f"Iteration: {iteration}")
 
+            remaining = budget.remaining_evals()
+            if remaining is not None:
+                for group, max_eval in zip(optimizer.param_groups, max_evals):
+                    if max_eval is not None:
+                        group["max_eval"] = min(max_eval, remaining)
+
             def closure():
+                # a step can take many evaluations, the budget must also hold within it
+                if budget.exhausted():
+                    raise BudgetExhausted
+                budget.count()
                 optimizer.zero_grad()
 
-                # correcting to 0-1 range
-                x.data.clamp_(0, 1)
-                outputs = model(x)
+                if image is not None:
+                    pixels = image()
+                else:
+                    # correcting to 0-1 range
+                    if not bounded:
+                        x.data.clamp_(0, 1)
+                    pixels = x
+
+                if loss_fn is not None:
+                    total_content_loss, total_style_loss, loss = loss_fn(pixels)
+                    loss.backward()
+                    metrics.record(total_content_loss, total_style_loss, loss)
+                    return loss
 
-                # input content and style representations
-                content_feature_maps = outputs["conv4"][1]
-                style_feature_maps = []
-                for i in range(1, 6):
-                    style_feature_maps.append(outputs[f"conv{i}"][0])
+                outputs = model(pixels)
 
-                # input content and style losses
-                total_content_loss = content_loss(content_feature_maps)
+                # input content and style losses, weighted per layer
+                total_content_loss = 0
+                for layer, weight in spec.content.items():
+                    total_content_loss += (weight * content_losses[layer](outputs[layer]))
 
                 total_style_loss = 0
-                for feature_map, style_loss in zip(style_feature_maps, style_losses):
-                    total_style_loss += (style_weight * style_loss(feature_map))
+                for layer, weight in spec.style.items():
+                    total_style_loss += (style_weight * weight * style_losses[layer](outputs[layer]))
 
                 # total loss
                 loss = (alpha * total_content_loss) + (beta * total_style_loss)
                 loss.backward()
 
-                iterations.set_postfix({
-                    "content loss": total_content_loss.item(),
-                    "style loss": total_style_loss.item(),
-                    "total loss": loss.item()
-                })
+                metrics.record(total_content_loss, total_style_loss, loss)
 
                 return loss
 
-            optimizer.step(closure)
+            # sketched style losses draw a new sketch per iteration, fixed within the step
+            for style_loss in style_losses.values():
+                if hasattr(style_loss, "resample"):
+                    style_loss.resample()
+
+            # iterate the step starts from, restored if the budget runs out at a trial point within it
+            snapshot = [p.detach().clone() for p in params]
+            try:
+                loss = optimizer.step(closure)
+            except BudgetExhausted:
+                with torch.no_grad():
+                    for p, saved in zip(params, snapshot):
+                        p.copy_(saved)
+                break
+            if budget.update(loss):
+                break
+            if checkpoint is not None and (iteration + 1) % checkpoint.every == 0:
+                checkpoint.save(iteration + 1, x if image is None else image, optimizer, budget, metrics, targets)
+        metrics.flush()
+
+    if accepted_steps is not None:
+        budget.accept(optimizer.accepted_steps - accepted_steps)
+
+    for group, max_eval in zip(optimizer.param_groups, max_evals):
+        if max_eval is not None:
+            group["max_eval"] = max_eval
+
+    if image is not None:
+        with torch.no_grad():
+            return image()
 
     # final correction
     x.data.clamp_(0, 1)
     return x
 
 
+def train_pyramid(model: nn.Module, 
+                  make_losses: Callable[[Tuple[int, int]], Tuple[Dict[str, ContentLoss], Dict[str, StyleLoss]]], 
+                  x: torch.Tensor, levels: List[Tuple[Tuple[int, int], int]], 
+                  optimizer_fn: Callable[[List[torch.Tensor]], optim.Optimizer]=optim.LBFGS, 
+                  spec: LayerSpec=PRESETS["gatys"], 
+                  alpha: int=1, beta: int=1000000, style_weight: Union[int, float]=1.0, 
+                  budget: Optional[Budget]=None, metrics: Optional[MetricsRecorder]=None, 
+                  compiler: Optional[LossCompiler]=None, parameterization: str="pixel", 
+                  checkpoint: Optional[Checkpointer]=None) -> torch.Tensor:
+    """
+    Train the neural style transfer algorithm coarse-to-fine over several resolutions.
+
+    Each level is optimized with fresh losses and a fresh optimizer at its own resolution, starting
+    from the result of the previous level upsampled to the level size. Most of the structure
+    converges at the cheap low resolution levels, so only a few iterations are needed at the end.
+
+    Args:
+        model (nn.Module): The VGG19 feature extractor for training the style transfer algorithm.
+        make_losses (Callable): Builds the content losses and the style losses for a (height, width).
+        x (torch.Tensor): The batch of input images, at any resolution.
+        levels (List[Tuple[Tuple[int, int], int]]): The (height, width) and number of iterations of 
+                                                    each level, from coarse to fine.
+        optimizer_fn (Callable): Builds the optimizer for the parameters of a level.
+        spec (LayerSpec): The content and style layers and their weights.
+        alpha (int): The weight given to content loss while computing the total loss.
+        beta (int): The weight given to style loss while computing the total loss.
+        style_weight Union[int, float]: The weight given to style loss of each layer while computing total style loss.
+        budget (Optional[Budget]): Budgets shared by all levels. Once exhausted, the remaining levels
+                                   only upsample the result.
+        metrics (Optional[MetricsRecorder]): Records the losses of every closure evaluation.
+        compiler (Optional[LossCompiler]): Compiles the loss of each level, or None to run it eagerly.
+        parameterization (str): The space the image is optimized in, one of ``PARAMETERIZATIONS``. Each
+                                level re-encodes the upsampled image.
+        checkpoint (Optional[Checkpointer]): Checkpoints the level being optimized. Levels completed
+                                             before a resumed checkpoint are skipped.
+
+    Returns:
+        x (torch.Tensor): The input image with the content and style transfered, at the last level size.
+    """
+    for level, (size, iterations) in enumerate(levels):
+        x = x.detach()
+        if tuple(x.shape[-2:]) != tuple(size):
+            x = F.interpolate(x, size=size, mode="bilinear", align_corners=False).clamp_(0, 1)
+        if budget is not None and budget.exhausted():
+            continue
+        if checkpoint is not None:
+            if checkpoint.skip_level(level):
+                continue
+            checkpoint.level = level
+
+        content_losses, style_losses = make_losses(size)
+        if parameterization == "pixel":
+            image = x.requires_grad_()
+            optimizer = optimizer_fn([image])
+        else:
+            image = parameterize(parameterization, x)
+            optimizer = optimizer_fn(list(image.parameters()))
+        x = train(model, optimizer, content_losses, style_losses, image, iterations=iterations,
+                  alpha=alpha, beta=beta, style_weight=style_weight, spec=spec, budget=budget, 
+                  metrics=metrics, compiler=compiler, checkpoint=checkpoint)
+
+    return x
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file